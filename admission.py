@@ -0,0 +1,111 @@
+"""Admission control: cap in-flight work and shed load beyond a bounded queue"""
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed instead of admitted"""
+
+    def __init__(self, status_code, reason, retry_after):
+        super().__init__(f"Server overloaded ({reason})")
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self):
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class AdmissionController:
+    """Bounded concurrency with a bounded FIFO wait queue.
+
+    Up to max_in_flight requests run at once. Up to max_queue more wait,
+    each for at most max_wait seconds. A request arriving to a full queue
+    is rejected immediately with 429; one that waits too long gets 503.
+    Retry-After is estimated from the recent time requests hold a slot.
+    """
+
+    def __init__(self, max_in_flight=32, max_queue=64, max_wait=5.0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self._waiters = deque()
+        self._service_time = 0.5
+        self.admitted = 0
+        self.shed = {"queue_full": 0, "queue_timeout": 0}
+
+    @property
+    def queue_depth(self):
+        return len(self._waiters)
+
+    def retry_after(self):
+        """Rough time for the current backlog to drain"""
+        backlog = self.in_flight + len(self._waiters)
+        return max(1.0, self._service_time * backlog / max(1, self.max_in_flight))
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one in-flight slot for the duration of the block or raise Overloaded"""
+        await self._acquire()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            # Exponentially weighted service time for Retry-After estimates
+            elapsed = time.perf_counter() - started
+            self._service_time = 0.9 * self._service_time + 0.1 * elapsed
+            self._release()
+
+    async def _acquire(self):
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.shed["queue_full"] += 1
+            raise Overloaded(429, "queue_full", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we gave up: pass it on
+                self._release()
+            else:
+                waiter.cancel()
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(exc, asyncio.CancelledError):
+                raise
+            self.shed["queue_timeout"] += 1
+            raise Overloaded(503, "queue_timeout", self.retry_after())
+        # Slot ownership was transferred by _release; in_flight is unchanged
+        self.admitted += 1
+
+    def _release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self):
+        return {
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "max_wait_seconds": self.max_wait,
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._waiters),
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+        }
@@ -0,0 +1,1014 @@
+"""Inference backends: where a prepared image actually gets classified.
+
+Every backend takes the JPEG payload produced by preprocessing and
+returns the model's prediction list ([{"label", "score"}, ...], best
+first). RemoteBackend calls the HuggingFace Inference API, LocalBackend
+runs the model in this process (transformers pipeline or ONNX Runtime)
+and HybridBackend routes between several backends by recent latency,
+hedging calls that run past the chosen backend's usual p95.
+"""
+import asyncio
+import ctypes
+import gc
+import logging
+import os
+import random
+from collections import deque
+
+import httpx
+from fastapi import HTTPException
+
+from batching import MicroBatcher
+from inference_executor import InferenceExecutor, configure_torch_threads
+from metrics import LATENCY_BUCKETS, Counter, Gauge, Histogram, StageTimer
+from preprocessing import decode_image
+from resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryBudget,
+    backoff_delay,
+    retry_after_header,
+)
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class InferenceBackend:
+    """Interface shared by all backends"""
+
+    name = "backend"
+
+    def preload(self):
+        """Load what can be shared before the server forks its workers (e.g. model weights)"""
+
+    async def start(self):
+        """Acquire resources (clients, models); called once on app startup"""
+
+    async def stop(self):
+        """Release resources; called once on app shutdown"""
+
+    @property
+    def ready(self):
+        """True once the backend can serve predictions"""
+        return True
+
+    def available(self):
+        """True if a call right now is likely to be attempted rather than fail fast"""
+        return self.ready
+
+    @property
+    def model_key(self):
+        """Identifies what produces this backend's answers, for cache and store keys.
+
+        Backends giving the same answers (the Inference API and a float32
+        pipeline of one model) share a key, so their results are reused
+        across a switch; a quantized or cheaper model gets its own.
+        """
+        return self.name
+
+    async def classify(self, payload, timer):
+        """Predictions for one prepared image payload"""
+        raise NotImplementedError
+
+    async def warmup(self, payload):
+        """Run one throwaway prediction so the first real request finds everything warm"""
+        await self.classify(payload, StageTimer())
+
+    def stats(self):
+        return {"name": self.name, "ready": self.ready, "model_key": self.model_key}
+
+
+def _http2_available():
+    """HTTP/2 needs the optional h2 package (installed via httpx[http2])"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _loading_estimate(response):
+    """Seconds until the model is ready if this is a 'model is loading' response"""
+    if response.status_code != 503:
+        return None
+    try:
+        body = response.json()
+    except ValueError:
+        return None
+    if isinstance(body, dict) and "estimated_time" in body:
+        return float(body["estimated_time"])
+    return None
+
+
+def _retry_after_hint(response):
+    try:
+        return float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+
+class RemoteBackend(InferenceBackend):
+    """HuggingFace Inference API over a pooled keep-alive client.
+
+    Every call gets deadline seconds in total. Connection errors,
+    timeouts and 429/5xx responses are retried with jittered backoff
+    while the deadline and the shared retry budget allow. "Model is
+    loading" responses are waited out using the API's estimated_time,
+    shared with concurrent requests, and do not count as failures. When
+    the breaker is open requests fail immediately with Retry-After.
+    """
+
+    name = "remote"
+
+    def __init__(self, url, token=None, pool_size=64, keepalive_connections=32,
+                 keepalive_expiry=30.0, connect_timeout=5.0, read_timeout=30.0,
+                 pool_timeout=10.0, http2=True, deadline=25.0, max_retries=2,
+                 retry_base_delay=0.2, retry_max_delay=2.0, breaker=None,
+                 retry_budget=None, model_id=None, registry=None):
+        self.url = url
+        self.model_id = model_id
+        self.token = token
+        self.pool_size = pool_size
+        self.keepalive_connections = keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_timeout = pool_timeout
+        self.http2 = http2
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.retry_budget = retry_budget or RetryBudget()
+        self.client = None
+        # Event-loop time until which the Inference API said the model is loading
+        self.model_loading_until = 0.0
+
+        self.responses = Counter(
+            "upstream_responses",
+            "Inference API responses by HTTP status or failure kind",
+            labelnames=("status",),
+            registry=registry,
+        )
+        self.retries = Counter(
+            "upstream_retries",
+            "Inference API retries by reason",
+            labelnames=("reason",),
+            registry=registry,
+        )
+        self.fast_failures = Counter(
+            "upstream_circuit_rejections",
+            "Requests failed fast because the circuit breaker was open",
+            registry=registry,
+        )
+        Gauge(
+            "upstream_circuit_open",
+            "Circuit breaker state (0 closed, 0.5 half-open, 1 open)",
+            registry=registry,
+            function=lambda: {"closed": 0, "half_open": 0.5, "open": 1}[self.breaker.state],
+        )
+
+    async def start(self):
+        """Create the pooled keep-alive client used for all upstream calls"""
+        http2 = self.http2 and _http2_available()
+        self.client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(
+                connect=self.connect_timeout,
+                read=self.read_timeout,
+                write=self.read_timeout,
+                pool=self.pool_timeout,
+            ),
+        )
+        logger.info(f"Upstream client ready (pool={self.pool_size}, http2={http2})")
+
+    async def stop(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    @property
+    def ready(self):
+        return self.client is not None
+
+    def available(self):
+        return self.ready and self.breaker.state != "open"
+
+    @property
+    def model_key(self):
+        return self.model_id or self.url
+
+    async def classify(self, payload, timer):
+        if self.client is None:
+            raise HTTPException(
+                status_code=503,
+                detail="Model inference service is starting",
+                headers={"Retry-After": "1"}
+            )
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        headers = {}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+
+        self.retry_budget.record_request()
+        attempt = 0
+        while True:
+            # Another request already learned the model is cold: wait with it
+            loading_wait = self.model_loading_until - loop.time()
+            if loading_wait > 0:
+                if loop.time() + loading_wait >= deadline:
+                    raise HTTPException(
+                        status_code=503,
+                        detail="Model is loading on HuggingFace servers",
+                        headers={"Retry-After": retry_after_header(loading_wait)}
+                    )
+                with timer.stage("model_loading"):
+                    # Jitter so waiting requests don't all retry at the same instant
+                    await asyncio.sleep(loading_wait + random.uniform(0, 0.5))
+
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError as e:
+                self.fast_failures.inc()
+                raise HTTPException(
+                    status_code=503,
+                    detail="Model inference temporarily unavailable",
+                    headers={"Retry-After": retry_after_header(e.retry_after)}
+                )
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                self.breaker.release()
+                raise HTTPException(
+                    status_code=504,
+                    detail="Model inference timed out"
+                )
+
+            logger.info("Calling HuggingFace Inference API...")
+            hint = None
+            try:
+                with timer.stage("upstream"):
+                    response = await self.client.post(
+                        self.url,
+                        headers=headers,
+                        content=payload,
+                        timeout=httpx.Timeout(
+                            connect=min(self.connect_timeout, remaining),
+                            read=min(self.read_timeout, remaining),
+                            write=min(self.read_timeout, remaining),
+                            pool=min(self.pool_timeout, remaining),
+                        )
+                    )
+            except httpx.TimeoutException:
+                self.responses.labels("timeout").inc()
+                self.breaker.record_failure()
+                logger.error("HuggingFace API request timed out")
+                reason, status_code, detail = "timeout", 504, "Model inference timed out"
+            except httpx.TransportError as e:
+                self.responses.labels("connection_error").inc()
+                self.breaker.record_failure()
+                logger.error(f"HuggingFace API connection error: {str(e)}")
+                reason, status_code, detail = "connection_error", 503, "Model inference service unreachable"
+            except asyncio.CancelledError:
+                # Hedged away or client gone: neither a success nor a failure
+                self.breaker.release()
+                raise
+            else:
+                self.responses.labels(response.status_code).inc()
+                if response.status_code == 200:
+                    self.breaker.record_success()
+                    return response.json()
+
+                estimate = _loading_estimate(response)
+                if estimate is not None:
+                    # Cold model, not an outage: wait for it at the top of the loop
+                    self.breaker.release()
+                    self.retries.labels("model_loading").inc()
+                    self.model_loading_until = max(self.model_loading_until,
+                                                   loop.time() + max(estimate, 1.0))
+                    logger.info(f"Model is loading, estimated {estimate:.1f}s")
+                    continue
+
+                logger.error(f"HuggingFace API error: {response.status_code} - {response.text}")
+                if response.status_code not in RETRYABLE_STATUS:
+                    # The API answered, it just rejected this input: 502 rather
+                    # than 503 so callers (and the job runner) don't retry it
+                    self.breaker.record_success()
+                    raise HTTPException(
+                        status_code=502,
+                        detail=f"Model inference failed: {response.text}"
+                    )
+                if response.status_code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.release()
+                hint = _retry_after_hint(response)
+                reason, status_code, detail = str(response.status_code), 503, f"Model inference failed: {response.text}"
+
+            delay = max(hint or 0.0, backoff_delay(attempt, self.retry_base_delay, self.retry_max_delay))
+            if (
+                attempt >= self.max_retries
+                or loop.time() + delay >= deadline
+                or not self.retry_budget.try_spend()
+            ):
+                raise HTTPException(
+                    status_code=status_code,
+                    detail=detail
+                )
+            self.retries.labels(reason).inc()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "circuit": self.breaker.stats(),
+            "retry_budget": self.retry_budget.stats(),
+        }
+
+
+# Models loaded in this process by init_local_worker, keyed by backend
+# name: the app process in thread mode, or each pool worker in process mode
+_classifiers = {}
+
+
+def build_local_classifier(config):
+    """Build the configured runtime: a transformers pipeline or an ONNX Runtime session"""
+    if config["runtime"] == "onnx":
+        from onnx_backend import OnnxImageClassifier
+        return OnnxImageClassifier(
+            config["onnx_model_dir"],
+            quantized=config["onnx_quantized"],
+            intra_op_threads=config["torch_threads"],
+        )
+
+    import torch
+    from transformers import pipeline
+
+    # Inference only: never build autograd graphs
+    torch.set_grad_enabled(False)
+    torch_dtype = getattr(torch, config["torch_dtype"])
+    if config["mmap_weights"]:
+        from transformers import AutoImageProcessor
+        from mmap_weights import load_mmap_model
+
+        model = pipeline(
+            "image-classification",
+            model=load_mmap_model(
+                config["model_id"],
+                token=config["token"],
+                torch_dtype=torch_dtype,
+                trust_remote_code=config["trust_remote_code"],
+            ),
+            image_processor=AutoImageProcessor.from_pretrained(
+                config["model_id"], token=config["token"]),
+            device=-1,  # Force CPU
+        )
+    else:
+        model = pipeline(
+            "image-classification",
+            model=config["model_id"],
+            device=-1,  # Force CPU
+            token=config["token"],
+            torch_dtype=torch_dtype,
+            trust_remote_code=config["trust_remote_code"],
+            model_kwargs={"low_cpu_mem_usage": True},
+        )
+    # Free loader temporaries before serving
+    gc.collect()
+    return model
+
+
+def init_local_worker(config):
+    """Tune torch threads and load the model once in this process"""
+    configure_torch_threads(config["torch_threads"], config["interop_threads"])
+    if config["name"] not in _classifiers:
+        _classifiers[config["name"]] = build_local_classifier(config)
+
+
+def unload_local_worker(name):
+    """Drop a model loaded in this process and hand the freed memory back to the OS"""
+    _classifiers.pop(name, None)
+    release_memory()
+
+
+def release_memory():
+    """Collect garbage, then ask glibc to return free heap pages (no-op elsewhere)"""
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def classify_local_batch(name, payloads):
+    """Decode images and run one batched forward pass, returning predictions per image"""
+    images = [decode_image(payload) for payload in payloads]
+    return _classifiers[name](images, batch_size=len(images))
+
+
+class LocalBackend(InferenceBackend):
+    """Model running on this machine, behind micro-batching and an inference pool.
+
+    Concurrent requests are grouped into forward passes of up to
+    batch_max_size images (waiting at most batch_max_wait seconds), run
+    in a pool of executor_workers threads or processes with at most
+    max_concurrency batches in flight, so the event loop stays
+    responsive.
+
+    With idle_unload_after > 0 the model is dropped once no request has
+    used it for that many seconds, and reloaded by the next request
+    (which waits for it). Reloads are fastest with mmap_weights, where
+    the weights usually still sit in the page cache.
+    """
+
+    name = "local"
+
+    def __init__(self, model_id, runtime="pytorch", token=None, torch_dtype="float32",
+                 trust_remote_code=False, mmap_weights=False, onnx_model_dir="onnx_model",
+                 onnx_quantized=False, executor_kind="thread", executor_workers=1, max_concurrency=None,
+                 torch_threads=0, interop_threads=0, batch_max_size=8, batch_max_wait=0.01,
+                 idle_unload_after=0, name="local", registry=None):
+        self.name = name
+        self.runtime = runtime
+        self.idle_unload_after = idle_unload_after
+        self.config = {
+            "name": name,
+            "model_id": model_id,
+            "runtime": runtime,
+            "token": token,
+            "torch_dtype": torch_dtype,
+            "trust_remote_code": trust_remote_code,
+            "mmap_weights": mmap_weights,
+            "onnx_model_dir": onnx_model_dir,
+            "onnx_quantized": onnx_quantized,
+            "torch_threads": torch_threads,
+            "interop_threads": interop_threads,
+        }
+        max_concurrency = max_concurrency or executor_workers
+        self.executor = InferenceExecutor(
+            kind=executor_kind,
+            max_workers=executor_workers,
+            max_concurrency=max_concurrency,
+            # Thread workers share the model loaded once in start()
+            initializer=init_local_worker if executor_kind == "process" else None,
+            initargs=(self.config,) if executor_kind == "process" else (),
+        )
+        self.batcher = MicroBatcher(
+            self._run_batch,
+            max_batch_size=batch_max_size,
+            max_wait=batch_max_wait,
+            workers=max_concurrency,
+            registry=registry,
+        )
+        self._ready = False
+        self.load_error = None
+        # Whether the model is in memory right now, as opposed to unloaded while idle
+        self.loaded = False
+        self._load_lock = asyncio.Lock()
+        self._active = 0
+        self._last_used = 0.0
+        self._reaper = None
+        self.unloads = 0
+        self.reloads = 0
+        self.last_reload_seconds = None
+
+        Gauge(
+            "local_model_loaded",
+            "1 while the local model is in memory",
+            registry=registry,
+            function=lambda: int(self.loaded),
+        )
+        self.unload_count = Counter(
+            "local_model_unloads",
+            "Times the local model was unloaded after being idle",
+            registry=registry,
+        )
+        self.reload_duration = Histogram(
+            "local_model_reload_seconds",
+            "Time for a request to reload the model after an idle unload",
+            LATENCY_BUCKETS,
+            registry=registry,
+        )
+
+    async def _run_batch(self, payloads):
+        """Run a batch in the inference pool so the event loop keeps serving"""
+        return await self.executor.run(classify_local_batch, self.name, payloads)
+
+    def preload(self):
+        """Load the model in this process so forked workers share its pages copy-on-write.
+
+        Only thread executors can use it: process pool workers are spawned
+        fresh and load their own copy. No forward pass runs here, so no
+        torch thread pools exist yet when the workers fork.
+        """
+        if self.executor.kind != "thread":
+            logger.warning("Model preloading needs INFERENCE_EXECUTOR=thread; skipping")
+            return
+        init_local_worker(self.config)
+        logger.info("Model preloaded before fork")
+
+    async def _load(self):
+        self.executor.start()
+        if self.executor.kind == "process":
+            # Each worker loads its own copy in init_local_worker
+            await self.executor.warmup(os.getpid)
+        else:
+            await self.executor.run(init_local_worker, self.config)
+        self.loaded = True
+        self._last_used = asyncio.get_running_loop().time()
+
+    async def _unload(self):
+        self.loaded = False
+        if self.executor.kind == "process":
+            # Worker processes hold the model; stopping them frees it all
+            await asyncio.to_thread(self.executor.shutdown, True)
+        else:
+            await self.executor.run(unload_local_worker, self.name)
+        self.unloads += 1
+        self.unload_count.inc()
+
+    async def _reap_idle(self):
+        """Unload the model once it has gone unused for idle_unload_after seconds"""
+        loop = asyncio.get_running_loop()
+        interval = min(30.0, max(1.0, self.idle_unload_after / 4))
+        while True:
+            await asyncio.sleep(interval)
+            async with self._load_lock:
+                idle = loop.time() - self._last_used
+                if not self.loaded or self._active or idle < self.idle_unload_after:
+                    continue
+                logger.info(f"Unloading local model after {idle:.0f}s idle")
+                try:
+                    await self._unload()
+                except Exception as e:
+                    logger.error(f"Failed to unload model: {str(e)}")
+
+    async def start(self):
+        """Load the model without blocking the event loop"""
+        try:
+            logger.info(f"Loading local model ({self.runtime}, {self.executor.kind} executor)...")
+            async with self._load_lock:
+                await self._load()
+            self.batcher.start()
+            self._ready = True
+            logger.info("Model loaded successfully")
+        except Exception as e:
+            self.load_error = str(e)
+            logger.error(f"Failed to load model: {str(e)}")
+            return
+        if self.idle_unload_after > 0:
+            self._reaper = asyncio.create_task(self._reap_idle())
+
+    async def stop(self):
+        """Stop the batching workers and the inference pool"""
+        self._ready = False
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        await self.batcher.stop()
+        self.executor.shutdown(wait=False)
+        self.loaded = False
+
+    @property
+    def ready(self):
+        return self._ready
+
+    @property
+    def model_key(self):
+        key = self.config["model_id"]
+        if self.runtime == "onnx":
+            return key + ("@onnx-int8" if self.config["onnx_quantized"] else "@onnx")
+        if self.config["torch_dtype"] not in (None, "float32"):
+            key += f"@{self.config['torch_dtype']}"
+        return key
+
+    async def classify(self, payload, timer):
+        if not self._ready:
+            raise HTTPException(
+                status_code=503,
+                detail="Model not loaded yet. Please wait and try again."
+            )
+        # Counted from before the reload so the reaper cannot unload under us
+        self._active += 1
+        try:
+            if not self.loaded:
+                await self._reload(timer)
+            with timer.stage("inference"):
+                return await self.batcher.submit(payload)
+        finally:
+            self._active -= 1
+            self._last_used = asyncio.get_running_loop().time()
+
+    async def _reload(self, timer):
+        async with self._load_lock:
+            if self.loaded:
+                return
+            logger.info("Reloading local model after idle unload...")
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            with timer.stage("model_reload"):
+                await self._load()
+            self.last_reload_seconds = loop.time() - started
+            self.reloads += 1
+            self.reload_duration.observe(self.last_reload_seconds)
+            logger.info(f"Model reloaded in {self.last_reload_seconds:.2f}s")
+
+    async def warmup(self, payload):
+        """One dummy forward pass per pool worker, so kernels and allocator pools are initialised"""
+        await asyncio.gather(*(
+            self.executor.run(classify_local_batch, self.name, [payload])
+            for _ in range(self.executor.max_workers)
+        ))
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "runtime": self.runtime,
+            "load_error": self.load_error,
+            "loaded": self.loaded,
+            "idle_unload_after": self.idle_unload_after,
+            "idle_seconds": round(asyncio.get_running_loop().time() - self._last_used, 1),
+            "unloads": self.unloads,
+            "reloads": self.reloads,
+            "last_reload_seconds": self.last_reload_seconds,
+            "batching": self.batcher.stats(),
+            "executor": self.executor.stats(),
+        }
+
+
+class LatencyWindow:
+    """Recent successful call latencies of one backend"""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self._samples.append(seconds)
+
+    def percentile(self, pct):
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class HybridBackend(InferenceBackend):
+    """Route each call to the fastest available backend and hedge slow calls.
+
+    Backends are ranked by median latency over their last window
+    successful calls (a backend with no samples yet is tried first), with
+    an explore share of calls sent to the runner-up so its numbers stay
+    current. If the chosen backend has not answered within its own p95
+    (clamped to [hedge_min_delay, hedge_max_delay]) the call is hedged to
+    the runner-up and whichever answers first wins; the other is
+    cancelled. Hedges draw from a budget so a slow period can add at most
+    hedge_ratio extra load. A backend that fails outright is failed over
+    immediately and ranked behind the healthy ones for failure_cooldown
+    seconds, so one that keeps failing (without tripping a circuit
+    breaker) is not tried first on every call.
+    """
+
+    name = "hybrid"
+
+    def __init__(self, backends, hedge=True, hedge_min_delay=0.05, hedge_max_delay=10.0,
+                 hedge_ratio=0.1, window=200, explore=0.05, failure_cooldown=30.0,
+                 registry=None):
+        self.backends = backends
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.hedge_budget = RetryBudget(ratio=hedge_ratio, min_per_second=0.1, max_tokens=10.0)
+        self.explore = explore
+        self.latency = {backend.name: LatencyWindow(window) for backend in backends}
+        self.failure_cooldown = failure_cooldown
+        # Event-loop time until which each backend is ranked last after a failure
+        self._demoted_until = {backend.name: 0.0 for backend in backends}
+        self.routes = Counter(
+            "backend_routes",
+            "Calls sent to each backend (first choice, hedge or failover)",
+            labelnames=("backend", "reason"),
+            registry=registry,
+        )
+        self.wins = Counter(
+            "backend_wins",
+            "Calls answered by each backend",
+            labelnames=("backend",),
+            registry=registry,
+        )
+        self.call_latency = Histogram(
+            "backend_call_duration_seconds",
+            "Successful call latency per backend",
+            LATENCY_BUCKETS,
+            labelnames=("backend",),
+            registry=registry,
+        )
+
+    def preload(self):
+        for backend in self.backends:
+            backend.preload()
+
+    async def start(self):
+        await asyncio.gather(*(backend.start() for backend in self.backends))
+
+    async def stop(self):
+        await asyncio.gather(*(backend.stop() for backend in self.backends))
+
+    async def warmup(self, payload):
+        """Warm every backend that loaded; one failing does not keep the others cold"""
+        ready = [backend for backend in self.backends if backend.ready]
+        results = await asyncio.gather(*(backend.warmup(payload) for backend in ready),
+                                       return_exceptions=True)
+        for backend, result in zip(ready, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Warmup of backend {backend.name} failed: {str(result)}")
+
+    @property
+    def ready(self):
+        return any(backend.ready for backend in self.backends)
+
+    def available(self):
+        return any(backend.available() for backend in self.backends)
+
+    @property
+    def model_key(self):
+        keys = sorted({backend.model_key for backend in self.backends})
+        return keys[0] if len(keys) == 1 else f"hybrid({'|'.join(keys)})"
+
+    def _demoted(self, backend, now):
+        return self._demoted_until[backend.name] > now
+
+    def _ranked(self):
+        now = asyncio.get_running_loop().time()
+        candidates = [backend for backend in self.backends if backend.available()]
+
+        def rank(backend):
+            value = self.latency[backend.name].percentile(50)
+            return self._demoted(backend, now), -1.0 if value is None else value
+
+        candidates.sort(key=rank)
+        if (
+            len(candidates) > 1
+            and not self._demoted(candidates[1], now)
+            and random.random() < self.explore
+        ):
+            candidates[0], candidates[1] = candidates[1], candidates[0]
+        return candidates
+
+    def _hedge_delay(self, backend):
+        p95 = self.latency[backend.name].percentile(95)
+        if p95 is None:
+            return self.hedge_max_delay
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, p95))
+
+    async def _timed(self, backend, payload, timer):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            preds = await backend.classify(payload, timer)
+        except Exception:
+            self._demoted_until[backend.name] = loop.time() + self.failure_cooldown
+            raise
+        elapsed = loop.time() - started
+        self._demoted_until[backend.name] = 0.0
+        self.latency[backend.name].add(elapsed)
+        self.call_latency.labels(backend.name).observe(elapsed)
+        return preds
+
+    async def classify(self, payload, timer):
+        order = self._ranked()
+        if not order:
+            raise HTTPException(
+                status_code=503,
+                detail="Model inference temporarily unavailable",
+                headers={"Retry-After": "5"}
+            )
+        self.hedge_budget.record_request()
+
+        primary, fallbacks = order[0], list(order[1:])
+        self.routes.labels(primary.name, "primary").inc()
+        running = {asyncio.ensure_future(self._timed(primary, payload, timer)): primary}
+        hedge_delay = self._hedge_delay(primary) if self.hedge and fallbacks else None
+        last_error = None
+        try:
+            while running:
+                done, _ = await asyncio.wait(
+                    running, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+                hedge_delay = None
+                if not done:
+                    # Primary is slower than usual: race it against the next backend
+                    if fallbacks and self.hedge_budget.try_spend():
+                        backend = fallbacks.pop(0)
+                        self.routes.labels(backend.name, "hedge").inc()
+                        running[asyncio.ensure_future(self._timed(backend, payload, timer))] = backend
+                    continue
+                for task in done:
+                    backend = running.pop(task)
+                    if task.exception() is None:
+                        self.wins.labels(backend.name).inc()
+                        return task.result()
+                    last_error = task.exception()
+                    logger.warning(f"Backend {backend.name} failed: {str(last_error)}")
+                if not running and fallbacks:
+                    backend = fallbacks.pop(0)
+                    self.routes.labels(backend.name, "failover").inc()
+                    running[asyncio.ensure_future(self._timed(backend, payload, timer))] = backend
+            raise last_error
+        finally:
+            for task in running:
+                task.cancel()
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "backends": {
+                backend.name: {
+                    **backend.stats(),
+                    "latency_p50": self.latency[backend.name].percentile(50),
+                    "latency_p95": self.latency[backend.name].percentile(95),
+                    "samples": len(self.latency[backend.name]),
+                    "demoted": self._demoted(backend, asyncio.get_running_loop().time()),
+                }
+                for backend in self.backends
+            },
+            "hedge_budget": self.hedge_budget.stats(),
+        }
+
+
+class ProvisionalPredictions(list):
+    """Predictions returned as a stopgap when the authoritative model failed.
+
+    They answer the current request but must not be cached or stored,
+    where they would stand in for the real model's answer.
+    """
+
+
+def prediction_confidence(preds):
+    """(top score, lead of the top score over the runner-up) of a prediction list"""
+    scores = sorted((float(pred["score"]) for pred in preds), reverse=True)
+    if not scores:
+        return 0.0, 0.0
+    return scores[0], scores[0] - (scores[1] if len(scores) > 1 else 0.0)
+
+
+class CascadeBackend(InferenceBackend):
+    """Answer from a cheap backend when it is confident, escalate when it is not.
+
+    Every call goes to first (e.g. the int8 ONNX model). Its answer is
+    kept when the top score is at least min_score and leads the runner-up
+    by at least min_margin; otherwise, or if first fails, the call goes
+    to second (the full local or remote model). If second fails too, a
+    low-confidence answer from first is returned rather than an error,
+    as ProvisionalPredictions so it is not cached.
+
+    Top-1 agreement between the two is recorded on every escalation, and
+    on an audit_rate sample of accepted answers that second re-checks in
+    the background (at most max_audits at a time), so the thresholds can
+    be tuned against what escalation would have said.
+    """
+
+    name = "cascade"
+
+    def __init__(self, first, second, min_score=0.8, min_margin=0.2, audit_rate=0.0,
+                 max_audits=4, registry=None):
+        self.first = first
+        self.second = second
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.audit_rate = audit_rate
+        self.max_audits = max_audits
+        self._audits = set()
+        self.outcomes = Counter(
+            "cascade_calls",
+            "Cascade calls by outcome (accepted, escalated, first_failed, fallback)",
+            labelnames=("outcome",),
+            registry=registry,
+        )
+        self.agreement = Counter(
+            "cascade_agreement",
+            "Top-1 agreement of the cheap model with the full one (escalation or audit)",
+            labelnames=("check", "result"),
+            registry=registry,
+        )
+
+    def preload(self):
+        self.first.preload()
+        self.second.preload()
+
+    async def start(self):
+        # One after the other: two local stages importing transformers from
+        # two threads at once can trip over its lazy module loading
+        await self.first.start()
+        await self.second.start()
+
+    async def stop(self):
+        for task in self._audits:
+            task.cancel()
+        await asyncio.gather(self.first.stop(), self.second.stop())
+
+    async def warmup(self, payload):
+        """Warm both stages that loaded; one failing does not keep the other cold"""
+        ready = [backend for backend in (self.first, self.second) if backend.ready]
+        results = await asyncio.gather(*(backend.warmup(payload) for backend in ready),
+                                       return_exceptions=True)
+        for backend, result in zip(ready, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Warmup of backend {backend.name} failed: {str(result)}")
+
+    @property
+    def ready(self):
+        # Without the cheap stage every call simply escalates
+        return self.second.ready
+
+    def available(self):
+        return self.first.available() or self.second.available()
+
+    @property
+    def model_key(self):
+        # Accepted answers come from the cheap model, so never share the full model's key
+        return f"cascade({self.first.model_key}>{self.second.model_key})"
+
+    def _record_agreement(self, check, cheap, full):
+        agree = bool(cheap) and bool(full) and cheap[0]["label"] == full[0]["label"]
+        self.agreement.labels(check, "agree" if agree else "disagree").inc()
+
+    async def _audit(self, payload, cheap):
+        try:
+            full = await self.second.classify(payload, StageTimer())
+        except Exception as e:
+            logger.warning(f"Cascade audit failed: {str(e)}")
+            return
+        self._record_agreement("audit", cheap, full)
+
+    def _maybe_audit(self, payload, cheap):
+        if (
+            self.audit_rate <= 0
+            or len(self._audits) >= self.max_audits
+            or random.random() >= self.audit_rate
+            or not self.second.available()
+        ):
+            return
+        task = asyncio.ensure_future(self._audit(payload, cheap))
+        self._audits.add(task)
+        task.add_done_callback(self._audits.discard)
+
+    async def classify(self, payload, timer):
+        cheap = None
+        if self.first.available():
+            try:
+                cheap = await self.first.classify(payload, timer)
+            except Exception as e:
+                logger.warning(f"Cascade first stage failed: {str(e)}")
+        if cheap:
+            score, margin = prediction_confidence(cheap)
+            if score >= self.min_score and margin >= self.min_margin:
+                self.outcomes.labels("accepted").inc()
+                self._maybe_audit(payload, cheap)
+                return cheap
+        else:
+            self.outcomes.labels("first_failed").inc()
+
+        try:
+            full = await self.second.classify(payload, timer)
+        except Exception:
+            if not cheap:
+                raise
+            self.outcomes.labels("fallback").inc()
+            logger.warning("Escalation failed, returning the low-confidence answer")
+            return ProvisionalPredictions(cheap)
+        if cheap:
+            self.outcomes.labels("escalated").inc()
+            self._record_agreement("escalation", cheap, full)
+        return full
+
+    def stats(self):
+        outcomes = {outcome: int(self.outcomes.labels(outcome).value)
+                    for outcome in ("accepted", "escalated", "first_failed", "fallback")}
+        calls = sum(outcomes.values())
+        agreement = {}
+        for check in ("escalation", "audit"):
+            agree = self.agreement.labels(check, "agree").value
+            checked = agree + self.agreement.labels(check, "disagree").value
+            agreement[check] = round(agree / checked, 4) if checked else None
+        return {
+            **super().stats(),
+            "min_score": self.min_score,
+            "min_margin": self.min_margin,
+            "audit_rate": self.audit_rate,
+            "outcomes": outcomes,
+            "escalation_rate": round((calls - outcomes["accepted"]) / calls, 4) if calls else None,
+            "agreement": agreement,
+            "stages": {"first": self.first.stats(), "second": self.second.stats()},
+        }
@@ -0,0 +1,156 @@
+"""Dynamic micro-batching for local model inference"""
+import asyncio
+import logging
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Group concurrent requests into batched forward passes.
+
+    Callers submit one item and await its result. A background worker
+    takes the first queued item, keeps collecting until it has
+    max_batch_size items or max_wait seconds have passed, hands the batch
+    to run_batch (an async callable returning one result per item) and
+    resolves every caller's future from the output. With workers > 1,
+    several batches can be in flight at once (e.g. one per process in a
+    process pool). Pass registry to export the queue depth and batch size
+    histograms on /metrics.
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait=0.01, workers=1, registry=None):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.workers = workers
+        self._queue = None
+        self._workers = []
+        self.batches = 0
+        self.items = 0
+        self.queue_depth = Histogram(
+            "batch_queue_depth",
+            "Requests already waiting when a new one is enqueued",
+            [0, 1, 2, 4, 8, 16, 32, 64, 128],
+            registry=registry,
+        )
+        self.batch_size = Histogram(
+            "batch_size",
+            "Number of requests per forward pass",
+            [1, 2, 4, 8, 16, 32, 64],
+            registry=registry,
+        )
+
+    @property
+    def running(self):
+        return any(not worker.done() for worker in self._workers)
+
+    def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self):
+        if not self._workers:
+            return
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        # Fail anything still waiting so callers don't hang
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Batcher stopped"))
+
+    async def submit(self, item):
+        """Queue one item and wait for its result"""
+        if not self.running:
+            raise RuntimeError("Batcher is not running")
+        future = asyncio.get_running_loop().create_future()
+        self.queue_depth.observe(self._queue.qsize())
+        self._queue.put_nowait((item, future))
+        return await future
+
+    async def _collect(self):
+        """Wait for the first item, then fill the batch until full or timed out"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Callers that gave up while queued don't need a slot in the batch
+        return [(item, future) for item, future in batch if not future.done()]
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            self.batch_size.observe(len(batch))
+            try:
+                results = await self.run_batch([item for item, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(
+                        f"Batch returned {len(results)} results for {len(batch)} inputs"
+                    )
+            except asyncio.CancelledError:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(RuntimeError("Batcher stopped"))
+                raise
+            except Exception as e:
+                if len(batch) == 1:
+                    if not batch[0][1].done():
+                        batch[0][1].set_exception(e)
+                    continue
+                # Retry one by one so a single bad input only fails its own caller
+                logger.warning(f"Batch of {len(batch)} failed, retrying individually: {str(e)}")
+                await self._run_individually(batch)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def _run_individually(self, batch):
+        for item, future in batch:
+            if future.done():
+                continue
+            try:
+                (result,) = await self.run_batch([item])
+            except asyncio.CancelledError:
+                for _, pending in batch:
+                    if not pending.done():
+                        pending.set_exception(RuntimeError("Batcher stopped"))
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "workers": self.workers,
+            "batches": self.batches,
+            "items": self.items,
+            "pending": self._queue.qsize() if self._queue else 0,
+            "queue_depth": self.queue_depth.snapshot(),
+            "batch_size": self.batch_size.snapshot(),
+        }
@@ -0,0 +1,202 @@
+"""Compare accuracy and latency of the PyTorch pipeline against ONNX Runtime.
+
+Usage:
+    python export_onnx.py --output onnx_model --quantize
+    python benchmarks/compare_backends.py --images path/to/images --onnx-dir onnx_model
+
+Every image is classified by the PyTorch pipeline (the reference), the
+fp32 ONNX model and, if present, the int8 quantized ONNX model. The
+report lists top-1 agreement with PyTorch, score drift, and per-image and
+batched latency for each backend, and is written as JSON.
+
+It also simulates INFERENCE_BACKEND=cascade with the fastest ONNX model
+as the first stage and PyTorch as the second. For a range of
+CASCADE_MIN_SCORE / CASCADE_MIN_MARGIN settings it reports how many
+images would escalate, how often the final answer matches PyTorch, and
+the resulting mean latency per image.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import prediction_confidence  # noqa: E402
+from onnx_backend import ONNX_QUANTIZED_MODEL_FILE, OnnxImageClassifier  # noqa: E402
+from preprocessing import decode_image  # noqa: E402
+
+MODEL_ID = "Saon110/fish-shrimp-disease-classifier"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+# (min_score, min_margin) pairs to simulate for the cascade
+CASCADE_THRESHOLDS = [(0.5, 0.0), (0.6, 0.1), (0.7, 0.2), (0.8, 0.2), (0.9, 0.3), (0.95, 0.5)]
+
+
+def load_images(directory, limit=None):
+    paths = sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    if limit:
+        paths = paths[:limit]
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append((os.path.basename(path), decode_image(f.read())))
+    return images
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_backend(classifier, images, batch_size, warmup=2):
+    """Return per-image predictions plus single-image and batched latencies (ms)"""
+    for _, image in images[:warmup]:
+        classifier([image], batch_size=1)
+
+    predictions, single_ms = [], []
+    for _, image in images:
+        start = time.perf_counter()
+        (preds,) = classifier([image], batch_size=1)
+        single_ms.append((time.perf_counter() - start) * 1000)
+        predictions.append(preds)
+
+    batch_ms = []
+    for i in range(0, len(images), batch_size):
+        batch = [image for _, image in images[i:i + batch_size]]
+        start = time.perf_counter()
+        classifier(batch, batch_size=len(batch))
+        batch_ms.append((time.perf_counter() - start) * 1000 / len(batch))
+
+    return predictions, {
+        "p50_ms": round(percentile(single_ms, 50), 2),
+        "p95_ms": round(percentile(single_ms, 95), 2),
+        "mean_ms": round(statistics.mean(single_ms), 2),
+        "batched_mean_ms_per_image": round(statistics.mean(batch_ms), 2),
+    }
+
+
+def compare(reference, candidate):
+    """Top-1 agreement and score drift of candidate predictions vs reference"""
+    agree, drift = 0, []
+    for ref, cand in zip(reference, candidate):
+        if ref[0]["label"] == cand[0]["label"]:
+            agree += 1
+        cand_scores = {p["label"]: p["score"] for p in cand}
+        drift.append(abs(ref[0]["score"] - cand_scores.get(ref[0]["label"], 0.0)))
+    return {
+        "top1_agreement": round(agree / len(reference), 4),
+        "mean_abs_score_diff": round(statistics.mean(drift), 5),
+        "max_abs_score_diff": round(max(drift), 5),
+    }
+
+
+def simulate_cascade(reference, cheap, reference_ms, cheap_ms):
+    """Escalation rate, agreement with the reference and mean latency per cascade threshold"""
+    rows = []
+    for min_score, min_margin in CASCADE_THRESHOLDS:
+        escalated = agree = 0
+        for ref, cand in zip(reference, cheap):
+            score, margin = prediction_confidence(cand)
+            if score >= min_score and margin >= min_margin:
+                agree += ref[0]["label"] == cand[0]["label"]
+            else:
+                # Escalated images get the reference answer
+                escalated += 1
+                agree += 1
+        rate = escalated / len(reference)
+        rows.append({
+            "min_score": min_score,
+            "min_margin": min_margin,
+            "escalation_rate": round(rate, 4),
+            "top1_agreement": round(agree / len(reference), 4),
+            "mean_ms": round(cheap_ms + rate * reference_ms, 2),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", required=True, help="Directory of test images")
+    parser.add_argument("--onnx-dir", default="onnx_model")
+    parser.add_argument("--model", default=MODEL_ID)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Intra-op threads for both runtimes (0 = default)")
+    parser.add_argument("--output", default="benchmarks/results/backend_comparison.json")
+    args = parser.parse_args()
+
+    import torch
+    from transformers import pipeline
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    torch.set_grad_enabled(False)
+
+    images = load_images(args.images, args.limit)
+    if not images:
+        parser.error(f"No images found in {args.images}")
+
+    backends = {
+        "pytorch": pipeline("image-classification", model=args.model,
+                            device=-1, torch_dtype=torch.float32),
+        "onnx": OnnxImageClassifier(args.onnx_dir, intra_op_threads=args.threads),
+    }
+    if os.path.exists(os.path.join(args.onnx_dir, ONNX_QUANTIZED_MODEL_FILE)):
+        backends["onnx-int8"] = OnnxImageClassifier(
+            args.onnx_dir, quantized=True, intra_op_threads=args.threads)
+
+    report = {"images": len(images), "batch_size": args.batch_size, "backends": {}}
+    reference = None
+    all_predictions = {}
+    for name, classifier in backends.items():
+        predictions, latency = run_backend(classifier, images, args.batch_size)
+        all_predictions[name] = predictions
+        entry = {"latency": latency}
+        if reference is None:
+            reference = predictions
+        else:
+            entry["accuracy_vs_pytorch"] = compare(reference, predictions)
+            entry["speedup_vs_pytorch"] = round(
+                report["backends"]["pytorch"]["latency"]["mean_ms"] / latency["mean_ms"], 2)
+        report["backends"][name] = entry
+
+    first = "onnx-int8" if "onnx-int8" in backends else "onnx"
+    report["cascade"] = {
+        "first_stage": first,
+        "thresholds": simulate_cascade(
+            reference,
+            all_predictions[first],
+            report["backends"]["pytorch"]["latency"]["mean_ms"],
+            report["backends"][first]["latency"]["mean_ms"],
+        ),
+    }
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'backend':<12}{'p50 ms':>10}{'p95 ms':>10}{'batched':>10}{'top1':>8}{'drift':>10}")
+    for name, entry in report["backends"].items():
+        latency = entry["latency"]
+        accuracy = entry.get("accuracy_vs_pytorch", {"top1_agreement": 1.0, "mean_abs_score_diff": 0.0})
+        print(f"{name:<12}{latency['p50_ms']:>10}{latency['p95_ms']:>10}"
+              f"{latency['batched_mean_ms_per_image']:>10}"
+              f"{accuracy['top1_agreement']:>8}{accuracy['mean_abs_score_diff']:>10}")
+    print(f"\ncascade {first} -> pytorch")
+    print(f"{'min_score':>10}{'margin':>8}{'escalated':>11}{'top1':>8}{'mean ms':>10}")
+    for row in report["cascade"]["thresholds"]:
+        print(f"{row['min_score']:>10}{row['min_margin']:>8}{row['escalation_rate']:>11}"
+              f"{row['top1_agreement']:>8}{row['mean_ms']:>10}")
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
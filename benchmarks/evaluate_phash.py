@@ -0,0 +1,211 @@
+"""Evaluate near-duplicate matching by perceptual hash.
+
+Usage:
+    python benchmarks/evaluate_phash.py
+    python benchmarks/evaluate_phash.py --images path/to/tank/photos --max-threshold 20
+
+Builds a PerceptualIndex from a set of reference images, then queries it
+with (a) edited copies of those references that should match their own
+original (recompression, EXIF, brightness, sensor noise, resize, small
+crop or shift) and (b) held-out images that should match nothing. For
+each Hamming threshold it reports the near-duplicate hit rate, the rate
+of matches to the wrong reference and the rate at which unrelated images
+match anything. Hashes go through preprocessing.prepare_image exactly as
+on the /predict path.
+
+With --images the references come from a directory of real photos
+(the last --holdout of them are kept out of the index); otherwise
+synthetic tank scenes are generated. Results are saved as JSON under
+benchmarks/results/.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+from PIL import Image, ImageDraw, ImageEnhance  # noqa: E402
+
+from phash_index import PerceptualIndex  # noqa: E402
+from preprocessing import prepare_image  # noqa: E402
+
+
+def encode(image, quality=90, exif=None):
+    buffer = io.BytesIO()
+    kwargs = {"exif": exif} if exif is not None else {}
+    image.save(buffer, format="JPEG", quality=quality, **kwargs)
+    return buffer.getvalue()
+
+
+def tank_scene(seed, fish, size=(1280, 720)):
+    """Synthetic tank frame: water gradient, gravel, fish-like ellipses and noise.
+
+    seed fixes the tank itself (water and gravel), fish is what moves.
+    """
+    rng = random.Random(seed)
+    width, height = size
+    image = Image.merge("RGB", [
+        Image.linear_gradient("L").rotate(rng.randint(0, 359)).resize(size)
+        for _ in range(3)
+    ])
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([0, int(height * 0.8), width, height],
+                   fill=tuple(rng.randint(60, 160) for _ in range(3)))
+    # Rocks and plants that make each tank look different
+    for _ in range(rng.randint(4, 10)):
+        x, y = rng.randint(0, width), rng.randint(int(height * 0.3), height)
+        points = [(x + rng.randint(-150, 150), y + rng.randint(-250, 50)) for _ in range(5)]
+        draw.polygon(points, fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    for x, y, w, h, colour in fish:
+        draw.ellipse([x, y, x + w, y + h], fill=colour)
+    noise = Image.effect_noise(size, 20).convert("RGB")
+    return Image.blend(image, noise, 0.1)
+
+
+def random_fish(rng, size=(1280, 720), count=None):
+    width, height = size
+    return [
+        (rng.randint(0, width - 200), rng.randint(0, int(height * 0.7)),
+         rng.randint(80, 200), rng.randint(30, 80),
+         tuple(rng.randint(0, 255) for _ in range(3)))
+        for _ in range(count or rng.randint(2, 6))
+    ]
+
+
+def variants(image, rng, scene=None):
+    """Near-duplicate edits of one frame, as (name, jpeg bytes)"""
+    width, height = image.size
+    exif = Image.Exif()
+    exif[0x0132] = time.strftime("%Y:%m:%d %H:%M:%S")
+    exif[0x010F] = "PondCam"
+    edits = [
+        ("recompress_q70", encode(image, quality=70)),
+        ("recompress_q95", encode(image, quality=95)),
+        ("exif", encode(image, exif=exif)),
+        ("brighter_5pct", encode(ImageEnhance.Brightness(image).enhance(1.05))),
+        ("sensor_noise", encode(Image.blend(
+            image, Image.effect_noise(image.size, 30).convert("RGB"), 0.05))),
+        ("half_size", encode(image.resize((width // 2, height // 2)))),
+        ("crop_2pct", encode(image.crop((width // 50, height // 50,
+                                         width - width // 50, height - height // 50)))),
+    ]
+    if scene is not None:
+        # Same tank a moment later: fish moved a few pixels
+        seed, fish = scene
+        moved = [(x + rng.randint(-8, 8), y + rng.randint(-8, 8), w, h, c)
+                 for x, y, w, h, c in fish]
+        edits.append(("fish_moved", encode(tank_scene(seed, moved, image.size))))
+    return edits
+
+
+def load_references(args, rng):
+    """[(name, image, scene or None)] for indexed references plus held-out images"""
+    if args.images:
+        names = sorted(
+            name for name in os.listdir(args.images)
+            if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp", ".bmp"))
+        )
+        images = []
+        for name in names:
+            with Image.open(os.path.join(args.images, name)) as image:
+                images.append((name, image.convert("RGB"), None))
+        return images
+    images = []
+    for i in range(args.count + args.holdout):
+        scene = (rng.getrandbits(32), random_fish(rng))
+        images.append((f"tank{i}", tank_scene(*scene), scene))
+    return images
+
+
+def image_hash(data):
+    return prepare_image(data, compute_dhash=True).dhash
+
+
+def evaluate(references, holdout, rng, max_threshold):
+    started = time.perf_counter()
+    reference_hashes = [(name, image_hash(encode(image))) for name, image, _ in references]
+    hash_ms = (time.perf_counter() - started) * 1000 / max(1, len(references))
+
+    queries = []
+    for name, image, scene in references:
+        for edit, data in variants(image, rng, scene):
+            queries.append((name, edit, image_hash(data)))
+    unrelated = [image_hash(encode(image)) for _, image, _ in holdout]
+
+    rows = []
+    for threshold in range(max_threshold + 1):
+        index = PerceptualIndex(threshold=threshold, max_entries=len(reference_hashes) + 1)
+        for name, hash_value in reference_hashes:
+            index.add(hash_value, name)
+        hits = wrong = 0
+        per_edit = {}
+        for name, edit, hash_value in queries:
+            match = index.find(hash_value)
+            correct = match is not None and match[0] == name
+            hits += correct
+            wrong += match is not None and not correct
+            per_edit.setdefault(edit, []).append(correct)
+        unrelated_matches = sum(index.find(h) is not None for h in unrelated)
+        rows.append({
+            "threshold": threshold,
+            "hit_rate": round(hits / len(queries), 4),
+            "wrong_match_rate": round(wrong / len(queries), 4),
+            "unrelated_match_rate": round(unrelated_matches / len(unrelated), 4) if unrelated else None,
+            "hit_rate_by_edit": {e: round(sum(v) / len(v), 4) for e, v in per_edit.items()},
+        })
+    return rows, hash_ms, len(queries)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", default=None, help="Directory of real photos to use")
+    parser.add_argument("--count", type=int, default=60, help="Synthetic reference images")
+    parser.add_argument("--holdout", type=int, default=60,
+                        help="Images kept out of the index to measure false matches")
+    parser.add_argument("--max-threshold", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    images = load_references(args, rng)
+    holdout_count = min(args.holdout, max(0, len(images) - 1))
+    references, holdout = images[:len(images) - holdout_count], images[len(images) - holdout_count:]
+
+    rows, hash_ms, query_count = evaluate(references, holdout, rng, args.max_threshold)
+
+    print(f"{len(references)} references, {query_count} near-duplicate queries, "
+          f"{len(holdout)} unrelated; dHash {hash_ms:.2f} ms/image\n")
+    print(f"{'threshold':>9}{'hit rate':>10}{'wrong':>8}{'unrelated':>11}")
+    for row in rows:
+        unrelated = row["unrelated_match_rate"]
+        print(f"{row['threshold']:>9}{row['hit_rate']:>10.3f}{row['wrong_match_rate']:>8.3f}"
+              f"{'-' if unrelated is None else format(unrelated, '.3f'):>11}")
+
+    results = {
+        "source": args.images or "synthetic",
+        "references": len(references),
+        "queries": query_count,
+        "unrelated": len(holdout),
+        "dhash_ms_per_image": round(hash_ms, 3),
+        "thresholds": rows,
+    }
+    output = args.output or os.path.join(BENCH_DIR, "results", f"phash-{int(time.time())}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Local stand-in for the HuggingFace Inference API used by the benchmarks.
+
+Responds to POST /models/{model_id} like the real API, with latency drawn
+from a log-normal distribution and a configurable share of errors and
+"model is loading" 503s, so the apps can be load-tested without touching
+HuggingFace.
+"""
+import asyncio
+import logging
+import random
+import socket
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+LABELS = [
+    "Fish_Healthy",
+    "Fish_Bacterial_Red_Disease",
+    "Fish_Fungal_Disease",
+    "Fish_Parasitic_Disease",
+    "Fish_White_Tail_Disease",
+    "Shrimp_Healthy",
+    "Shrimp_Black_Gill",
+    "Shrimp_White_Spot",
+]
+
+
+class UpstreamProfile:
+    """Latency and error distribution of the fake upstream"""
+
+    def __init__(self, latency_ms=300.0, latency_sigma=0.35, error_rate=0.0,
+                 loading_rate=0.0, estimated_time=2.0, seed=None):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.loading_rate = loading_rate
+        self.estimated_time = estimated_time
+        self.seed = seed
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+def create_fake_upstream(profile):
+    """Build the fake inference app for a given profile"""
+    app = FastAPI(title="Fake HuggingFace Inference API")
+    rng = random.Random(profile.seed)
+    stats = {"requests": 0, "errors": 0, "loading": 0, "bytes": 0}
+    app.state.stats = stats
+
+    @app.post("/models/{model_id:path}")
+    async def infer(model_id: str, request: Request):
+        body = await request.body()
+        stats["requests"] += 1
+        stats["bytes"] += len(body)
+
+        # Log-normal with the configured median, like real service latency
+        delay = profile.latency_ms / 1000 * rng.lognormvariate(0, profile.latency_sigma)
+        await asyncio.sleep(delay)
+
+        roll = rng.random()
+        if roll < profile.loading_rate:
+            stats["loading"] += 1
+            return JSONResponse(
+                status_code=503,
+                content={
+                    "error": f"Model {model_id} is currently loading",
+                    "estimated_time": profile.estimated_time,
+                },
+            )
+        if roll < profile.loading_rate + profile.error_rate:
+            stats["errors"] += 1
+            return JSONResponse(status_code=500, content={"error": "Internal error"})
+
+        scores = [rng.random() ** 3 for _ in LABELS]
+        total = sum(scores)
+        preds = sorted(
+            ({"label": label, "score": score / total} for label, score in zip(LABELS, scores)),
+            key=lambda pred: pred["score"],
+            reverse=True,
+        )
+        return preds[:5]
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(profile, port):
+    """Run the fake upstream until the process is terminated"""
+    import uvicorn
+
+    logging.getLogger("uvicorn.access").disabled = True
+    uvicorn.run(create_fake_upstream(profile), host="127.0.0.1", port=port,
+                log_level="warning")
@@ -0,0 +1,351 @@
+"""Load-test the inference backends in-process against a local fake upstream.
+
+Usage:
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --variants remote hybrid --concurrency 64 --requests 2000
+    python benchmarks/load_test.py --baseline benchmarks/results/<previous>.json
+
+Each variant is main.py with INFERENCE_BACKEND set to its name, booted
+in this process (startup hooks included) and driven through httpx's ASGI
+transport at a fixed concurrency. HF_API_URL points at
+benchmarks/fake_upstream.py running in a child process, so its CPU is
+not counted against the app. Variants that load the model locally are
+run only when torch and transformers are installed.
+
+Requests cycle through a generated corpus of JPEG/PNG/WebP images of
+several sizes. Unless --repeat-fraction says otherwise, each request
+gets a few random trailing bytes so it has a unique hash and misses the
+prediction cache; decoders ignore data after the end-of-image marker.
+
+Throughput, p50/p95/p99 latency, status counts, CPU time and RSS per
+variant are printed and saved as JSON under benchmarks/results/.
+"""
+import argparse
+import asyncio
+import importlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+# Every simulated client shares one address; per-client limits would cap the run
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+
+import httpx  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from fake_upstream import UpstreamProfile, free_port, serve  # noqa: E402
+
+REMOTE_VARIANTS = ["remote"]
+LOCAL_VARIANTS = ["local", "hybrid"]
+
+IMAGE_SIZES = [(320, 240), (800, 600), (1280, 960), (1920, 1080), (4032, 3024)]
+IMAGE_FORMATS = [
+    ("JPEG", "image/jpeg", ".jpg"),
+    ("PNG", "image/png", ".png"),
+    ("WEBP", "image/webp", ".webp"),
+]
+
+
+def generate_corpus(count, seed=0):
+    """Synthetic photos: colour gradients with mild noise, in several sizes and formats"""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(count):
+        width, height = IMAGE_SIZES[i % len(IMAGE_SIZES)]
+        fmt, content_type, ext = IMAGE_FORMATS[(i // len(IMAGE_SIZES)) % len(IMAGE_FORMATS)]
+        bands = [
+            Image.linear_gradient("L").rotate(rng.randint(0, 359)).resize((width, height))
+            for _ in range(3)
+        ]
+        image = Image.merge("RGB", bands)
+        noise = Image.effect_noise((width, height), rng.randint(10, 40)).convert("RGB")
+        image = Image.blend(image, noise, 0.15)
+        buffer = io.BytesIO()
+        image.save(buffer, format=fmt, quality=90)
+        corpus.append({
+            "filename": f"img{i}{ext}",
+            "content_type": content_type,
+            "data": buffer.getvalue(),
+            "size": [width, height],
+            "format": fmt,
+        })
+    return corpus
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def process_usage():
+    """(cpu_seconds, current_rss_mb, peak_rss_mb) of this process"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    with open("/proc/self/statm") as f:
+        rss_pages = int(f.read().split()[1])
+    rss_mb = rss_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    return usage.ru_utime + usage.ru_stime, rss_mb, usage.ru_maxrss / 1024
+
+
+def git_revision():
+    try:
+        sha = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                      text=True, stderr=subprocess.DEVNULL).strip()
+        dirty = subprocess.call(["git", "diff", "--quiet"], cwd=ROOT,
+                                stderr=subprocess.DEVNULL) != 0
+        return sha + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def wait_for_port(port, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.05)
+    raise RuntimeError(f"Fake upstream did not start on port {port}")
+
+
+def build_request(entry, rng, repeat_fraction):
+    """Return (filename, content_type, payload) for the next request"""
+    data = entry["data"]
+    if rng.random() >= repeat_fraction:
+        data = data + rng.randbytes(16)
+    return entry["filename"], entry["content_type"], data
+
+
+async def send_multipart(client, filename, content_type, payload):
+    return await client.post("/predict", files={"file": (filename, payload, content_type)})
+
+
+async def drive(app, corpus, total, concurrency, repeat_fraction, seed, send, warmup):
+    """Fire total requests at the app with a fixed number of concurrent clients"""
+    rng = random.Random(seed)
+    plan = [build_request(corpus[i % len(corpus)], rng, repeat_fraction) for i in range(total)]
+    warmup_plan = [build_request(corpus[i % len(corpus)], rng, 0.0) for i in range(warmup)]
+    latencies, ok_latencies = [], []
+    statuses, cache = Counter(), Counter()
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench",
+                                     timeout=300) as client:
+            # The model loads in the background; send traffic once it is ready
+            while (ready := await client.get("/ready")).status_code != 200:
+                if ready.json()["status"] == "failed":
+                    raise RuntimeError("Inference backend failed to start")
+                await asyncio.sleep(0.1)
+            for request in warmup_plan:
+                await send(client, *request)
+
+            next_index = 0
+
+            async def worker():
+                nonlocal next_index
+                while next_index < len(plan):
+                    request = plan[next_index]
+                    next_index += 1
+                    start = time.perf_counter()
+                    try:
+                        response = await send(client, *request)
+                        status = response.status_code
+                        cache[response.headers.get("x-cache", "-")] += 1
+                    except httpx.HTTPError:
+                        status = "transport_error"
+                    elapsed = (time.perf_counter() - start) * 1000
+                    latencies.append(elapsed)
+                    statuses[status] += 1
+                    if status == 200:
+                        ok_latencies.append(elapsed)
+
+            cpu_start, _, _ = process_usage()
+            wall_start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            wall = time.perf_counter() - wall_start
+            cpu_end, rss_mb, peak_rss_mb = process_usage()
+
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(total / wall, 2),
+        "ok_throughput_rps": round(statuses[200] / wall, 2),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "mean": round(statistics.mean(latencies), 2) if latencies else 0.0,
+            "max": round(max(latencies), 2) if latencies else 0.0,
+        },
+        "ok_latency_ms": {
+            "p50": round(percentile(ok_latencies, 50), 2),
+            "p95": round(percentile(ok_latencies, 95), 2),
+            "p99": round(percentile(ok_latencies, 99), 2),
+        },
+        "status_codes": {str(k): v for k, v in statuses.items()},
+        "cache": dict(cache),
+        "cpu_seconds": round(cpu_end - cpu_start, 3),
+        "cpu_ms_per_request": round((cpu_end - cpu_start) * 1000 / total, 3),
+        "cpu_utilisation": round((cpu_end - cpu_start) / wall, 3),
+        "rss_mb": round(rss_mb, 1),
+        "peak_rss_mb": round(peak_rss_mb, 1),
+    }
+
+
+def local_runtime_available():
+    try:
+        importlib.import_module("torch")
+        importlib.import_module("transformers")
+    except ImportError:
+        return False
+    return True
+
+
+def load_variant(name, upstream_url):
+    """Fresh main module configured for backend name (it reads config at import)"""
+    os.environ["INFERENCE_BACKEND"] = name
+    os.environ["HF_API_URL"] = upstream_url
+    if "main" in sys.modules:
+        return importlib.reload(sys.modules["main"])
+    return importlib.import_module("main")
+
+
+def compare_to_baseline(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nChange vs {baseline_path} ({baseline.get('git_revision', '?')}):")
+    for name, current in results["variants"].items():
+        previous = baseline.get("variants", {}).get(name)
+        if not previous or "skipped" in current or "skipped" in previous:
+            continue
+        deltas = []
+        for label, get in [
+            ("rps", lambda r: r["throughput_rps"]),
+            ("p50", lambda r: r["latency_ms"]["p50"]),
+            ("p95", lambda r: r["latency_ms"]["p95"]),
+            ("p99", lambda r: r["latency_ms"]["p99"]),
+            ("cpu/req", lambda r: r["cpu_ms_per_request"]),
+        ]:
+            before, after = get(previous), get(current)
+            change = (after - before) / before * 100 if before else 0.0
+            deltas.append(f"{label} {change:+.1f}%")
+        print(f"  {name:<22}" + "  ".join(deltas))
+
+
+def print_table(results):
+    print(f"\n{'variant':<22}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'cpu/req':>9}{'rss MB':>9}  status")
+    for name, result in results["variants"].items():
+        if "skipped" in result:
+            print(f"{name:<22}  skipped: {result['skipped']}")
+            continue
+        latency = result["latency_ms"]
+        print(f"{name:<22}{result['throughput_rps']:>9}{latency['p50']:>9}{latency['p95']:>9}"
+              f"{latency['p99']:>9}{result['cpu_ms_per_request']:>9}{result['rss_mb']:>9}"
+              f"  {result['status_codes']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--variants", nargs="+", default=REMOTE_VARIANTS + LOCAL_VARIANTS)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--corpus-size", type=int, default=15)
+    parser.add_argument("--repeat-fraction", type=float, default=0.0,
+                        help="Share of requests that reuse an exact earlier payload")
+    parser.add_argument("--latency-ms", type=float, default=300.0,
+                        help="Median fake upstream latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.35,
+                        help="Log-normal sigma of fake upstream latency")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--loading-rate", type=float, default=0.0,
+                        help="Share of upstream calls answered with 'model is loading'")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--baseline", default=None, help="Earlier results JSON to diff against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None, send=send_multipart, label="predict"):
+    args = parse_args(argv)
+    logging.disable(logging.INFO)
+
+    profile = UpstreamProfile(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        loading_rate=args.loading_rate,
+        seed=args.seed,
+    )
+    port = free_port()
+    upstream = multiprocessing.get_context("spawn").Process(
+        target=serve, args=(profile, port), daemon=True)
+    upstream.start()
+    wait_for_port(port)
+    upstream_url = f"http://127.0.0.1:{port}/models/Saon110/fish-shrimp-disease-classifier"
+
+    corpus = generate_corpus(args.corpus_size, seed=args.seed)
+    results = {
+        "benchmark": label,
+        "git_revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "upstream": profile.to_dict(),
+        "corpus": [
+            {"filename": e["filename"], "format": e["format"], "size": e["size"],
+             "bytes": len(e["data"])}
+            for e in corpus
+        ],
+        "variants": {},
+    }
+
+    try:
+        for name in args.variants:
+            if name in LOCAL_VARIANTS and not local_runtime_available():
+                results["variants"][name] = {"skipped": "torch/transformers not installed"}
+                continue
+            print(f"Running {name} ...", flush=True)
+            module = load_variant(name, upstream_url)
+            results["variants"][name] = asyncio.run(drive(
+                module.app, corpus, args.requests, args.concurrency,
+                args.repeat_fraction, args.seed, send, args.warmup,
+            ))
+    finally:
+        upstream.terminate()
+        upstream.join()
+
+    print_table(results)
+    output = args.output or os.path.join(
+        BENCH_DIR, "results", f"{label}-{results['git_revision']}-{int(time.time())}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+    if args.baseline:
+        compare_to_baseline(results, args.baseline)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Compare raw-body /predict/raw against multipart /predict.
+
+Usage:
+    python benchmarks/raw_vs_multipart.py
+    python benchmarks/raw_vs_multipart.py --requests 2000 --concurrency 64
+
+Runs benchmarks/load_test.py twice against the remote backend with the same
+corpus, seed and fake upstream settings, once sending each image as a
+multipart form upload and once as an application/octet-stream body, then
+prints the per-request CPU and latency difference. Any load_test.py
+option can be passed through; --variants is fixed to remote.
+"""
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import load_test  # noqa: E402
+
+
+async def send_raw(client, filename, content_type, payload):
+    return await client.post(
+        "/predict/raw",
+        content=payload,
+        headers={"Content-Type": content_type, "X-Filename": filename},
+    )
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv) + ["--variants", "remote"]
+    multipart = load_test.main(argv, send=load_test.send_multipart, label="predict-multipart")
+    raw = load_test.main(argv, send=send_raw, label="predict-raw")
+
+    before, after = multipart["variants"]["remote"], raw["variants"]["remote"]
+    print("\nraw vs multipart (remote):")
+    for label, get in [
+        ("cpu ms/req", lambda r: r["cpu_ms_per_request"]),
+        ("rps", lambda r: r["throughput_rps"]),
+        ("p50 ms", lambda r: r["latency_ms"]["p50"]),
+        ("p95 ms", lambda r: r["latency_ms"]["p95"]),
+        ("p99 ms", lambda r: r["latency_ms"]["p99"]),
+        ("peak rss MB", lambda r: r["peak_rss_mb"]),
+    ]:
+        old, new = get(before), get(after)
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"  {label:<12}{old:>10}{new:>10}  {change:+.1f}%")
+
+
+if __name__ == "__main__":
+    main()
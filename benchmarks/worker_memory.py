@@ -0,0 +1,183 @@
+"""Measure how much memory each gunicorn worker really costs.
+
+Usage:
+    python benchmarks/worker_memory.py
+    python benchmarks/worker_memory.py --workers 4 --variants copy preload+mmap --requests 50
+
+For each variant a gunicorn master (gunicorn.conf.py) is started with
+INFERENCE_BACKEND=local and the variant's settings:
+
+    copy          every worker loads its own copy of the weights
+    mmap          LOCAL_WEIGHTS_MMAP=1, weights shared via the page cache
+    preload       LOCAL_PRELOAD=1, model loaded in the master before fork
+    preload+mmap  both
+
+Once every worker reports ready (and has served --requests predictions,
+so lazily touched pages are counted) RSS, PSS and USS are read from
+/proc/<pid>/smaps_rollup for the master and each worker. The sum of RSS
+counts shared pages once per process; the sum of PSS is what the
+instance actually uses; per-worker USS is what one more worker adds.
+Results are printed and saved as JSON under benchmarks/results/.
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+import httpx  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from metrics import process_memory  # noqa: E402
+
+VARIANTS = {
+    "copy": {"LOCAL_PRELOAD": "0", "LOCAL_WEIGHTS_MMAP": "0"},
+    "mmap": {"LOCAL_PRELOAD": "0", "LOCAL_WEIGHTS_MMAP": "1"},
+    "preload": {"LOCAL_PRELOAD": "1", "LOCAL_WEIGHTS_MMAP": "0"},
+    "preload+mmap": {"LOCAL_PRELOAD": "1", "LOCAL_WEIGHTS_MMAP": "1"},
+}
+
+MB = 1024 * 1024
+
+
+def child_pids(parent):
+    """Pids whose parent is parent, found by scanning /proc"""
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields resume after its ')'
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == parent:
+            pids.append(int(entry))
+    return sorted(pids)
+
+
+def sample_image():
+    buffer = io.BytesIO()
+    Image.effect_noise((640, 480), 40).convert("RGB").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def wait_until_ready(base_url, workers, timeout):
+    """Poll /ready until enough consecutive 200s that every worker has likely answered"""
+    deadline = time.monotonic() + timeout
+    streak = 0
+    while time.monotonic() < deadline:
+        try:
+            response = httpx.get(f"{base_url}/ready", timeout=5)
+        except httpx.HTTPError:
+            ok = False
+        else:
+            if response.status_code == 503 and response.json()["status"] == "failed":
+                raise RuntimeError("A worker failed to load the model")
+            ok = response.status_code == 200
+        streak = streak + 1 if ok else 0
+        if streak >= 4 * workers:
+            return
+        time.sleep(0.05 if ok else 0.5)
+    raise RuntimeError(f"Workers not ready after {timeout}s")
+
+
+def run_variant(name, args, port):
+    jobs_dir = tempfile.mkdtemp(prefix="worker-memory-jobs-")
+    env = {
+        **os.environ,
+        **VARIANTS[name],
+        "INFERENCE_BACKEND": args.backend,
+        "WEB_CONCURRENCY": str(args.workers),
+        "PORT": str(port),
+        "RATE_LIMIT_ENABLED": "0",
+        "JOBS_DIR": jobs_dir,
+    }
+    master = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_ready(base_url, args.workers, args.timeout)
+        image = sample_image()
+        statuses = {}
+        for _ in range(args.requests):
+            # Trailing bytes give each request its own hash, so none is served from cache
+            payload = image + os.urandom(16)
+            status = httpx.post(f"{base_url}/predict/raw", content=payload,
+                                headers={"Content-Type": "image/jpeg"}, timeout=60).status_code
+            statuses[status] = statuses.get(status, 0) + 1
+
+        processes = {"master": process_memory(master.pid)}
+        for pid in child_pids(master.pid):
+            processes[f"worker-{pid}"] = process_memory(pid)
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait(timeout=30)
+        shutil.rmtree(jobs_dir, ignore_errors=True)
+
+    workers = [usage for key, usage in processes.items() if key.startswith("worker")]
+    return {
+        "settings": VARIANTS[name],
+        "statuses": {str(k): v for k, v in statuses.items()},
+        "processes": {key: {k: round(v / MB, 1) for k, v in usage.items()}
+                      for key, usage in processes.items()},
+        "total_rss_mb": round(sum(u["rss"] for u in processes.values()) / MB, 1),
+        "total_pss_mb": round(sum(u["pss"] for u in processes.values()) / MB, 1),
+        "worker_uss_mb": round(sum(u["uss"] for u in workers) / max(1, len(workers)) / MB, 1),
+        "worker_shared_mb": round(sum(u["shared"] for u in workers) / max(1, len(workers)) / MB, 1),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument("--backend", default="local", help="INFERENCE_BACKEND for the workers")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=20,
+                        help="Predictions to serve before measuring")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=600,
+                        help="Seconds to wait for the workers to become ready")
+    parser.add_argument("--output", default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {
+        "backend": args.backend,
+        "workers": args.workers,
+        "requests": args.requests,
+        "variants": {},
+    }
+    for offset, name in enumerate(args.variants):
+        print(f"Running {name} ...", flush=True)
+        results["variants"][name] = run_variant(name, args, args.port + offset)
+
+    print(f"\n{'variant':<14}{'sum RSS':>10}{'sum PSS':>10}{'USS/worker':>12}{'shared/worker':>15}  status")
+    for name, result in results["variants"].items():
+        print(f"{name:<14}{result['total_rss_mb']:>10.1f}{result['total_pss_mb']:>10.1f}"
+              f"{result['worker_uss_mb']:>12.1f}{result['worker_shared_mb']:>15.1f}  {result['statuses']}")
+
+    output = args.output or os.path.join(BENCH_DIR, "results", f"worker-memory-{int(time.time())}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
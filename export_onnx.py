@@ -0,0 +1,89 @@
+"""Export the fish disease classifier to ONNX, optionally with int8 weights.
+
+Usage:
+    python export_onnx.py --output onnx_model
+    python export_onnx.py --output onnx_model --quantize
+
+The output directory holds model.onnx (and model.int8.onnx when
+quantizing) next to the config.json and preprocessor_config.json that
+onnx_backend.OnnxImageClassifier needs at serving time.
+"""
+import argparse
+import logging
+import os
+
+from onnx_backend import ONNX_MODEL_FILE, ONNX_QUANTIZED_MODEL_FILE
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODEL_ID = "Saon110/fish-shrimp-disease-classifier"
+
+
+def export(model_id, output_dir, opset=17):
+    """Trace the PyTorch model and write model.onnx with a dynamic batch axis"""
+    import torch
+    from transformers import AutoImageProcessor, AutoModelForImageClassification
+
+    os.makedirs(output_dir, exist_ok=True)
+    processor = AutoImageProcessor.from_pretrained(model_id)
+    model = AutoModelForImageClassification.from_pretrained(
+        model_id,
+        torch_dtype=torch.float32,
+    )
+    model.eval()
+    # Export only the logits so the graph has a single, stable output
+    model.config.return_dict = False
+
+    size = processor.size
+    height = size.get("height") or size.get("shortest_edge")
+    width = size.get("width") or size.get("shortest_edge")
+    dummy = torch.zeros(1, 3, height, width, dtype=torch.float32)
+
+    model_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (dummy,),
+            model_path,
+            input_names=["pixel_values"],
+            output_names=["logits"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=opset,
+        )
+    model.config.save_pretrained(output_dir)
+    processor.save_pretrained(output_dir)
+    logger.info(f"Exported {model_id} to {model_path}")
+    return model_path
+
+
+def quantize(output_dir):
+    """Write model.int8.onnx with dynamically quantized int8 weights"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    source = os.path.join(output_dir, ONNX_MODEL_FILE)
+    target = os.path.join(output_dir, ONNX_QUANTIZED_MODEL_FILE)
+    quantize_dynamic(source, target, weight_type=QuantType.QInt8)
+    logger.info(
+        f"Quantized model written to {target} "
+        f"({os.path.getsize(source) / 1e6:.1f}MB -> {os.path.getsize(target) / 1e6:.1f}MB)"
+    )
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=MODEL_ID, help="HuggingFace model id")
+    parser.add_argument("--output", default="onnx_model", help="Output directory")
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--quantize", action="store_true",
+                        help="Also write an int8 dynamically-quantized model")
+    args = parser.parse_args()
+
+    export(args.model, args.output, opset=args.opset)
+    if args.quantize:
+        quantize(args.output)
+
+
+if __name__ == "__main__":
+    main()
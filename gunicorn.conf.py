@@ -0,0 +1,37 @@
+"""Gunicorn settings for serving main:app from several worker processes.
+
+Usage:
+    gunicorn -c gunicorn.conf.py main:app
+    WEB_CONCURRENCY=4 INFERENCE_BACKEND=local LOCAL_WEIGHTS_MMAP=1 gunicorn -c gunicorn.conf.py main:app
+
+The app is imported once in the master (preload_app) and, with
+INFERENCE_BACKEND=local and LOCAL_PRELOAD=1, the model is loaded there
+too before any worker is forked, so all workers share its pages
+copy-on-write instead of each loading a copy. gc.freeze() then moves
+everything allocated so far out of the collector's reach, so collections
+in the workers do not write to (and thereby un-share) the inherited
+objects. LOCAL_WEIGHTS_MMAP=1 shares the weights through the page cache
+even without preloading. benchmarks/worker_memory.py reports the
+resulting per-worker unique memory.
+"""
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Matches uvicorn --timeout-keep-alive in render.yaml
+keepalive = 120
+# Workers report in while the model warms up in the background, so this
+# only bounds a stuck request
+timeout = 120
+
+
+def when_ready(server):
+    """Runs in the master after the app is imported and before workers fork"""
+    if os.getenv('LOCAL_PRELOAD', '1') == '1':
+        import main
+        main.preload_inference_backend()
+    gc.collect()
+    gc.freeze()
@@ -0,0 +1,110 @@
+"""Bounded thread or process pool for CPU-heavy inference work"""
+import asyncio
+import functools
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def configure_torch_threads(intra_op_threads=0, inter_op_threads=0):
+    """Pin torch's intra/inter-op thread pools for this process (0 keeps the default)"""
+    try:
+        import torch
+    except ImportError:
+        return
+    if intra_op_threads > 0:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads > 0:
+        try:
+            torch.set_interop_threads(inter_op_threads)
+        except RuntimeError:
+            # Can only be set once, before any parallel work has started
+            logger.warning("torch inter-op threads already initialised, keeping current value")
+
+
+class InferenceExecutor:
+    """Run blocking callables off the event loop with a concurrency cap.
+
+    kind is "thread" (shares the model already loaded in this process) or
+    "process" (each worker loads its own model via initializer, so the
+    forward pass does not hold this process's GIL). At most
+    max_concurrency calls are submitted to the pool at once; the rest wait
+    on an asyncio semaphore instead of piling up inside the pool.
+    """
+
+    def __init__(self, kind="thread", max_workers=1, max_concurrency=None,
+                 initializer=None, initargs=()):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_concurrency = max_concurrency or max_workers
+        self.initializer = initializer
+        self.initargs = initargs
+        self._pool = None
+        self._semaphore = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+
+    def start(self):
+        if self._pool is not None:
+            return
+        if self.kind == "process":
+            # spawn gives each worker a clean interpreter instead of forking
+            # a process that already has event-loop and pool threads running
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=self.initializer,
+                initargs=self.initargs,
+            )
+        else:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="inference",
+                initializer=self.initializer,
+                initargs=self.initargs,
+            )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        logger.info(f"Inference executor started ({self.kind}, workers={self.max_workers}, "
+                    f"max_concurrency={self.max_concurrency})")
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in the pool once a concurrency slot is free"""
+        if self._pool is None:
+            raise RuntimeError("Inference executor is not running")
+        loop = asyncio.get_running_loop()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            return await loop.run_in_executor(self._pool, functools.partial(fn, *args))
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+    async def warmup(self, fn, *args):
+        """Submit one call per worker so the pool spawns and initialises its workers up front"""
+        await asyncio.gather(*(self.run(fn, *args) for _ in range(self.max_workers)))
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "max_workers": self.max_workers,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+        }
@@ -0,0 +1,433 @@
+"""Asynchronous bulk prediction jobs persisted in SQLite.
+
+A job is a set of images spooled to disk plus one row per image. Worker
+tasks claim pending images under a time-limited lease, run them through
+the normal prediction path and store each result, so clients can poll or
+stream progress long after the submitting request has returned. Leases
+make the queue crash-safe: an image whose worker died is claimed again
+once its lease expires, by this process after a restart or by any other
+worker sharing the database.
+"""
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    total INTEGER NOT NULL,
+    cancelled INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    filename TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,
+    lease_until REAL,
+    done_seq INTEGER,
+    result TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS job_items_queue ON job_items (status, available_at);
+CREATE INDEX IF NOT EXISTS job_items_done ON job_items (job_id, done_seq);
+"""
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobStore:
+    """SQLite job queue with images spooled under spool_dir/<job id>/.
+
+    Every thread gets its own connection; claims and completions run in
+    BEGIN IMMEDIATE transactions so several workers (or processes) can
+    share one database without handing out the same image twice.
+    """
+
+    def __init__(self, path, spool_dir):
+        self.path = path
+        self.spool_dir = spool_dir
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        os.makedirs(spool_dir, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _item_path(self, job_id, idx):
+        return os.path.join(self.spool_dir, job_id, f"{idx}.img")
+
+    def create_job(self, entries, max_total_bytes=None):
+        """Spool [(filename, image, error)] to disk and queue them; returns the job id.
+
+        Each image is streamed to its spool file by image.save(path), so
+        it is never held in memory whole. Entries that already failed
+        validation, or whose save raises ValueError, are recorded as failed
+        straight away so the job's results cover every submitted file.
+        Raises ValueError, keeping nothing, once more than max_total_bytes
+        have been spooled.
+        """
+        job_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.spool_dir, job_id))
+        now = time.time()
+        rows = []
+        seq = 0
+        spooled = 0
+        try:
+            for idx, (filename, image, error) in enumerate(entries):
+                status = 400
+                if not error:
+                    path = self._item_path(job_id, idx)
+                    try:
+                        spooled += image.save(path)
+                    except ValueError as e:
+                        error, status = str(e), getattr(e, "status_code", 400)
+                        os.remove(path)
+                    if max_total_bytes is not None and spooled > max_total_bytes:
+                        raise ValueError(f"Job exceeds the {max_total_bytes} byte limit")
+                if error:
+                    seq += 1
+                    record = {"index": idx, "filename": filename, "error": error,
+                              "status": status, "seq": seq}
+                    rows.append((job_id, idx, filename, FAILED, seq, json.dumps(record)))
+                    continue
+                rows.append((job_id, idx, filename, PENDING, None, None))
+
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT INTO jobs (id, created_at, updated_at, total) VALUES (?, ?, ?, ?)",
+                    (job_id, now, now, len(entries)),
+                )
+                conn.executemany(
+                    "INSERT INTO job_items (job_id, idx, filename, status, done_seq, result) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except Exception:
+            shutil.rmtree(os.path.join(self.spool_dir, job_id), ignore_errors=True)
+            raise
+        return job_id
+
+    def claim(self, limit, lease_seconds):
+        """Lease up to limit runnable images: pending ones, or running ones whose lease expired"""
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT i.job_id, i.idx, i.filename, i.attempts FROM job_items i "
+                "JOIN jobs j ON j.id = i.job_id "
+                "WHERE (i.status = ? AND i.available_at <= ?) "
+                "OR (i.status = ? AND i.lease_until < ?) "
+                "ORDER BY j.created_at, i.idx LIMIT ?",
+                (PENDING, now, RUNNING, now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE job_items SET status = ?, lease_until = ?, attempts = attempts + 1 "
+                "WHERE job_id = ? AND idx = ?",
+                [(RUNNING, now + lease_seconds, job_id, idx) for job_id, idx, _, _ in rows],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [
+            {
+                "job_id": job_id,
+                "index": idx,
+                "filename": filename,
+                "attempts": attempts + 1,
+                "path": self._item_path(job_id, idx),
+            }
+            for job_id, idx, filename, attempts in rows
+        ]
+
+    def finish(self, job_id, idx, record):
+        """Store the result of a leased image and drop its spooled bytes"""
+        now = time.time()
+        status = FAILED if "error" in record else DONE
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            (seq,) = conn.execute(
+                "SELECT COALESCE(MAX(done_seq), 0) + 1 FROM job_items WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+            record = {**record, "seq": seq}
+            updated = conn.execute(
+                "UPDATE job_items SET status = ?, result = ?, done_seq = ?, lease_until = NULL "
+                "WHERE job_id = ? AND idx = ? AND status = ?",
+                (status, json.dumps(record), seq, job_id, idx, RUNNING),
+            ).rowcount
+            conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (now, job_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if updated:
+            try:
+                os.remove(self._item_path(job_id, idx))
+            except FileNotFoundError:
+                pass
+        return bool(updated)
+
+    def release(self, job_id, idx, delay=0.0):
+        """Put a leased image back in the queue, runnable again after delay seconds"""
+        self._connection().execute(
+            "UPDATE job_items SET status = ?, lease_until = NULL, available_at = ? "
+            "WHERE job_id = ? AND idx = ? AND status = ?",
+            (PENDING, time.time() + delay, job_id, idx, RUNNING),
+        )
+
+    def get_job(self, job_id):
+        """Job summary with per-status counts, or None if unknown"""
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT created_at, updated_at, total, cancelled FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        created_at, updated_at, total, cancelled = row
+        counts = dict(conn.execute(
+            "SELECT status, COUNT(*) FROM job_items WHERE job_id = ? GROUP BY status",
+            (job_id,),
+        ).fetchall())
+        finished = counts.get(DONE, 0) + counts.get(FAILED, 0)
+        if cancelled and counts.get(CANCELLED):
+            status = CANCELLED
+        elif finished == total:
+            status = "completed"
+        elif finished or counts.get(RUNNING):
+            status = RUNNING
+        else:
+            status = "queued"
+        return {
+            "job_id": job_id,
+            "status": status,
+            "total": total,
+            "completed": counts.get(DONE, 0),
+            "failed": counts.get(FAILED, 0),
+            "pending": counts.get(PENDING, 0),
+            "running": counts.get(RUNNING, 0),
+            "cancelled": counts.get(CANCELLED, 0),
+            "progress": round(finished / total, 4) if total else 1.0,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    def results(self, job_id, after=0, limit=1000):
+        """Finished records in completion order, starting after sequence number after"""
+        rows = self._connection().execute(
+            "SELECT result FROM job_items WHERE job_id = ? AND done_seq > ? "
+            "ORDER BY done_seq LIMIT ?",
+            (job_id, after, limit),
+        ).fetchall()
+        return [json.loads(result) for (result,) in rows]
+
+    def cancel(self, job_id):
+        """Stop queued work for a job; results already stored are kept"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            found = conn.execute(
+                "UPDATE jobs SET cancelled = 1, updated_at = ? WHERE id = ?",
+                (time.time(), job_id),
+            ).rowcount
+            conn.execute(
+                "UPDATE job_items SET status = ?, lease_until = NULL "
+                "WHERE job_id = ? AND status IN (?, ?)",
+                (CANCELLED, job_id, PENDING, RUNNING),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if found:
+            shutil.rmtree(os.path.join(self.spool_dir, job_id), ignore_errors=True)
+        return bool(found)
+
+    def backlog(self):
+        """Images not yet finished across all jobs"""
+        (count,) = self._connection().execute(
+            "SELECT COUNT(*) FROM job_items WHERE status IN (?, ?)",
+            (PENDING, RUNNING),
+        ).fetchone()
+        return count
+
+    def purge(self, older_than):
+        """Delete jobs last updated more than older_than seconds ago that have no work left"""
+        cutoff = time.time() - older_than
+        conn = self._connection()
+        job_ids = [job_id for (job_id,) in conn.execute(
+            "SELECT id FROM jobs WHERE updated_at < ? AND NOT EXISTS ("
+            "SELECT 1 FROM job_items WHERE job_id = jobs.id AND status IN (?, ?))",
+            (cutoff, PENDING, RUNNING),
+        ).fetchall()]
+        for job_id in job_ids:
+            conn.execute("DELETE FROM job_items WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            shutil.rmtree(os.path.join(self.spool_dir, job_id), ignore_errors=True)
+        if job_ids:
+            logger.info(f"Purged {len(job_ids)} expired jobs")
+        return len(job_ids)
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "backlog": self.backlog(),
+        }
+
+
+class JobRunner:
+    """Background workers draining a JobStore with bounded concurrency.
+
+    process(index, filename, contents) returns the record to store for an
+    image. Records whose status is in retry_statuses (the server was busy,
+    not the image bad) are put back in the queue with a delay until
+    max_attempts is reached. With retention set, one more task purges jobs
+    finished more than retention seconds ago, on start and then every
+    purge_interval seconds.
+    """
+
+    def __init__(self, store, process, concurrency=4, lease_seconds=90.0, poll_interval=1.0,
+                 max_attempts=3, retry_delay=5.0, retry_statuses=(429, 503), retention=None,
+                 purge_interval=600.0):
+        self.store = store
+        self.process = process
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.retry_statuses = retry_statuses
+        self.retention = retention
+        self.purge_interval = purge_interval
+        self._tasks = []
+        self._wakeup = None
+        self.processed = 0
+        self.retried = 0
+        self.purged = 0
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.concurrency)]
+        if self.retention is not None:
+            self._tasks.append(asyncio.ensure_future(self._purger()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self):
+        """Signal idle workers that new work was queued"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _worker(self):
+        while True:
+            try:
+                items = await asyncio.to_thread(self.store.claim, 1, self.lease_seconds)
+            except sqlite3.Error as e:
+                logger.warning(f"Job queue claim failed: {str(e)}")
+                items = []
+            if not items:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(items[0])
+            except (sqlite3.Error, OSError) as e:
+                # The lease will expire and the image will be retried
+                logger.error(f"Job item {items[0]['job_id']}/{items[0]['index']} failed: {str(e)}")
+
+    async def _purger(self):
+        while True:
+            try:
+                self.purged += await asyncio.to_thread(self.store.purge, self.retention)
+            except (sqlite3.Error, OSError) as e:
+                logger.warning(f"Job purge failed: {str(e)}")
+            await asyncio.sleep(self.purge_interval)
+
+    async def _run(self, item):
+        job_id, idx = item["job_id"], item["index"]
+        try:
+            try:
+                contents = await asyncio.to_thread(_read_file, item["path"])
+            except FileNotFoundError:
+                record = {"index": idx, "filename": item["filename"],
+                          "error": "Spooled image is missing", "status": 500}
+            else:
+                record = await self.process(idx, item["filename"], contents)
+        except asyncio.CancelledError:
+            # Shutting down: hand the image back instead of waiting for the lease
+            await asyncio.to_thread(self.store.release, job_id, idx)
+            raise
+
+        if record.get("status") in self.retry_statuses and item["attempts"] < self.max_attempts:
+            delay = float(record.get("retry_after") or self.retry_delay * item["attempts"])
+            self.retried += 1
+            await asyncio.to_thread(self.store.release, job_id, idx, delay)
+            return
+        await asyncio.to_thread(self.store.finish, job_id, idx, record)
+        self.processed += 1
+
+    def stats(self):
+        return {
+            "workers": self.concurrency,
+            "processed": self.processed,
+            "retried": self.retried,
+            "purged": self.purged,
+        }
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
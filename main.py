@@ -1,16 +1,69 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+import time
+
+# Taken before the imports below so startup timings include them
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from PIL import Image
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from typing import List
+import asyncio
+import contextlib
 import io
+import json
 import logging
 import traceback
 import os
-import requests
+from PIL import Image
+
+import metrics
+from admission import AdmissionController, Overloaded
+from backends import (
+    CascadeBackend,
+    HybridBackend,
+    LocalBackend,
+    ProvisionalPredictions,
+    RemoteBackend,
+)
+from jobs import JobRunner, JobStore
+from metrics import (
+    LATENCY_BUCKETS,
+    SIZE_BUCKETS,
+    Counter,
+    Gauge,
+    Histogram,
+    Registry,
+    RequestTimingMiddleware,
+    StageTimer,
+)
+
+from prediction_cache import PredictionCache, cache_key, image_digest
+from monitoring import LatestFrame, ScoreSmoother, frame_dhash
+from phash_index import PerceptualIndex, hamming
+from prediction_store import PredictionStore
+from rate_limit import InMemoryBucketStore, RateLimitMiddleware, RedisBucketStore, validate_limits
+from preprocessing import PreprocessStats, prepare_image
+from resilience import CircuitBreaker, RetryBudget
+from singleflight import SingleFlight
+from uploads import (
+    BatchImage,
+    BodySizeLimitMiddleware,
+    UploadRejected,
+    UploadedImage,
+    check_image_header,
+    is_zip_upload,
+    iter_upload,
+    list_zip_images,
+    peek,
+    read_limited,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# httpx logs every request at INFO, which floods the logs on the hot path
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
 app = FastAPI(title="Fish Disease Classifier API")
 
@@ -27,12 +80,580 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Cache", "Server-Timing", "Retry-After", "X-RateLimit-Limit", "X-RateLimit-Remaining", "ETag"],
 )
 
+# Inference backend: "remote" (HuggingFace Inference API), "local" (model
+# loaded in this process), "hybrid" (both, routed by recent latency) or
+# "cascade" (a cheap local model first, escalating uncertain answers)
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'remote')
+
 # HuggingFace configuration
-HF_API_URL = "https://api-inference.huggingface.co/models/Saon110/fish-shrimp-disease-classifier"
+MODEL_ID = os.getenv('MODEL_ID', 'Saon110/fish-shrimp-disease-classifier')
+HF_API_URL = os.getenv('HF_API_URL', f"https://api-inference.huggingface.co/models/{MODEL_ID}")
 HF_TOKEN = os.getenv('HF_TOKEN')
 
+# Upstream HTTP client configuration
+HF_POOL_SIZE = int(os.getenv('HF_POOL_SIZE', '64'))
+HF_KEEPALIVE_CONNECTIONS = int(os.getenv('HF_KEEPALIVE_CONNECTIONS', '32'))
+HF_KEEPALIVE_EXPIRY = float(os.getenv('HF_KEEPALIVE_EXPIRY', '30'))
+HF_CONNECT_TIMEOUT = float(os.getenv('HF_CONNECT_TIMEOUT', '5'))
+HF_READ_TIMEOUT = float(os.getenv('HF_READ_TIMEOUT', '30'))
+HF_POOL_TIMEOUT = float(os.getenv('HF_POOL_TIMEOUT', '10'))
+HF_HTTP2 = os.getenv('HF_HTTP2', '1') == '1'
+
+# Upstream resilience configuration: each call gets UPSTREAM_DEADLINE seconds
+# including retries; the breaker opens after CIRCUIT_FAILURE_THRESHOLD
+# consecutive failures and probes again after CIRCUIT_RESET_TIMEOUT seconds
+UPSTREAM_DEADLINE = float(os.getenv('UPSTREAM_DEADLINE', '25'))
+UPSTREAM_MAX_RETRIES = int(os.getenv('UPSTREAM_MAX_RETRIES', '2'))
+UPSTREAM_RETRY_BASE_DELAY = float(os.getenv('UPSTREAM_RETRY_BASE_DELAY', '0.2'))
+UPSTREAM_RETRY_MAX_DELAY = float(os.getenv('UPSTREAM_RETRY_MAX_DELAY', '2'))
+RETRY_BUDGET_RATIO = float(os.getenv('RETRY_BUDGET_RATIO', '0.2'))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', '15'))
+
+# Local model configuration: runtime "pytorch" (transformers pipeline) or
+# "onnx" (ONNX Runtime, using a model exported with export_onnx.py); forward
+# passes run in a pool of INFERENCE_WORKERS threads or processes, at most
+# INFERENCE_MAX_CONCURRENCY at a time, grouping up to BATCH_MAX_SIZE
+# concurrent requests while waiting at most BATCH_MAX_WAIT_MS
+INFERENCE_RUNTIME = os.getenv('INFERENCE_RUNTIME', 'pytorch')
+LOCAL_TORCH_DTYPE = os.getenv('LOCAL_TORCH_DTYPE', 'float32')
+LOCAL_TRUST_REMOTE_CODE = os.getenv('LOCAL_TRUST_REMOTE_CODE', '0') == '1'
+# Map the checkpoint's weights instead of copying them into each process
+# (see mmap_weights.py); worker processes then share one copy in page cache
+LOCAL_WEIGHTS_MMAP = os.getenv('LOCAL_WEIGHTS_MMAP', '0') == '1'
+ONNX_MODEL_DIR = os.getenv('ONNX_MODEL_DIR', 'onnx_model')
+ONNX_QUANTIZED = os.getenv('ONNX_QUANTIZED', '0') == '1'
+INFERENCE_EXECUTOR = os.getenv('INFERENCE_EXECUTOR', 'thread')
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', '1'))
+INFERENCE_MAX_CONCURRENCY = int(os.getenv('INFERENCE_MAX_CONCURRENCY', str(INFERENCE_WORKERS)))
+TORCH_NUM_THREADS = int(os.getenv('TORCH_NUM_THREADS', '0'))
+TORCH_INTEROP_THREADS = int(os.getenv('TORCH_INTEROP_THREADS', '0'))
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '8'))
+BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', '10'))
+# Memory budget mode: drop the local model after LOCAL_IDLE_UNLOAD_SECONDS
+# without requests and reload it on the next one (0 keeps it loaded)
+LOCAL_IDLE_UNLOAD_SECONDS = float(os.getenv('LOCAL_IDLE_UNLOAD_SECONDS', '0'))
+
+# Hybrid routing: a call still running after the chosen backend's recent p95
+# (clamped to [HEDGE_MIN_DELAY_MS, HEDGE_MAX_DELAY_MS]) is also sent to the
+# next backend, with hedges limited to HEDGE_BUDGET_RATIO of calls. A backend
+# whose call fails is ranked last for ROUTING_FAILURE_COOLDOWN_SECONDS
+HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', '1') == '1'
+HEDGE_MIN_DELAY_MS = float(os.getenv('HEDGE_MIN_DELAY_MS', '50'))
+HEDGE_MAX_DELAY_MS = float(os.getenv('HEDGE_MAX_DELAY_MS', '10000'))
+HEDGE_BUDGET_RATIO = float(os.getenv('HEDGE_BUDGET_RATIO', '0.1'))
+ROUTING_WINDOW = int(os.getenv('ROUTING_WINDOW', '200'))
+ROUTING_EXPLORE = float(os.getenv('ROUTING_EXPLORE', '0.05'))
+ROUTING_FAILURE_COOLDOWN_SECONDS = float(os.getenv('ROUTING_FAILURE_COOLDOWN_SECONDS', '30'))
+
+# Cascade: the cheap stage (by default the int8 ONNX export in ONNX_MODEL_DIR)
+# answers when its top score is at least CASCADE_MIN_SCORE and leads the
+# runner-up by CASCADE_MIN_MARGIN; anything else goes to CASCADE_SECOND
+# (remote, local or hybrid). CASCADE_AUDIT_RATE of accepted answers are
+# re-checked by the second stage in the background to measure agreement
+CASCADE_SECOND = os.getenv('CASCADE_SECOND', 'remote')
+CASCADE_FIRST_RUNTIME = os.getenv('CASCADE_FIRST_RUNTIME', 'onnx')
+CASCADE_FIRST_MODEL = os.getenv('CASCADE_FIRST_MODEL', MODEL_ID)
+CASCADE_FIRST_QUANTIZED = os.getenv('CASCADE_FIRST_QUANTIZED', '1') == '1'
+CASCADE_MIN_SCORE = float(os.getenv('CASCADE_MIN_SCORE', '0.8'))
+CASCADE_MIN_MARGIN = float(os.getenv('CASCADE_MIN_MARGIN', '0.2'))
+CASCADE_AUDIT_RATE = float(os.getenv('CASCADE_AUDIT_RATE', '0.01'))
+
+# Startup: the server answers /health as soon as it is up while the backend
+# loads in the background; with WARMUP_ENABLED a dummy prediction then runs
+# before /ready reports ready
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', '1') == '1'
+
+warmup_task = None
+inference_warm = False
+# Seconds spent in each startup phase (import, preload, load, warmup, ready)
+startup_timings = {}
+
+# Prediction cache configuration (set PREDICTION_CACHE_SIZE=0 to disable)
+PREDICTION_CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', '2048'))
+PREDICTION_CACHE_TTL = float(os.getenv('PREDICTION_CACHE_TTL', '86400'))
+
+prediction_cache = PredictionCache(
+    max_entries=PREDICTION_CACHE_SIZE,
+    ttl=PREDICTION_CACHE_TTL,
+)
+
+# Optional persistent store shared by all workers on the node. Point
+# PREDICTION_STORE_PATH at a persistent disk to keep results across deploys.
+PREDICTION_STORE_PATH = os.getenv('PREDICTION_STORE_PATH')
+PREDICTION_STORE_MAX_ENTRIES = int(os.getenv('PREDICTION_STORE_MAX_ENTRIES', '100000'))
+
+prediction_store = None
+
+# Preprocessing configuration: images are downscaled to the model input
+# resolution before upload, and small RGB JPEGs are sent untouched
+PREPROCESS_TARGET_SIZE = int(os.getenv('PREPROCESS_TARGET_SIZE', '224'))
+PREPROCESS_PASSTHROUGH_MAX_SIDE = int(os.getenv('PREPROCESS_PASSTHROUGH_MAX_SIDE', str(2 * PREPROCESS_TARGET_SIZE)))
+PREPROCESS_JPEG_QUALITY = int(os.getenv('PREPROCESS_JPEG_QUALITY', '90'))
+
+preprocess_stats = PreprocessStats()
+
+# Near-duplicate reuse: when enabled, cache misses are matched by
+# perceptual hash (dHash) against recently classified images and reuse
+# their prediction if within PHASH_THRESHOLD bits of 64
+PHASH_ENABLED = os.getenv('PHASH_ENABLED', '0') == '1'
+PHASH_THRESHOLD = int(os.getenv('PHASH_THRESHOLD', '3'))
+PHASH_MAX_ENTRIES = int(os.getenv('PHASH_MAX_ENTRIES', '50000'))
+
+phash_index = PerceptualIndex(
+    threshold=PHASH_THRESHOLD,
+    max_entries=PHASH_MAX_ENTRIES,
+) if PHASH_ENABLED else None
+
+# Admission control: at most ADMISSION_MAX_IN_FLIGHT predictions run at once,
+# ADMISSION_MAX_QUEUE more wait up to ADMISSION_MAX_WAIT seconds, the rest
+# are shed with 429/503 and Retry-After
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', '32'))
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', '64'))
+ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', '5'))
+
+admission = AdmissionController(
+    max_in_flight=ADMISSION_MAX_IN_FLIGHT,
+    max_queue=ADMISSION_MAX_QUEUE,
+    max_wait=ADMISSION_MAX_WAIT,
+)
+
+# Upload limits: bodies are capped while they stream in, images are
+# checked by signature and header dimensions before they are decoded, and
+# PIL refuses to open anything over IMAGE_MAX_PIXELS (decompression bombs)
+PREDICT_MAX_IMAGE_BYTES = int(os.getenv('PREDICT_MAX_IMAGE_BYTES', str(20 * 1024 * 1024)))
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', str(50_000_000)))
+# Room for multipart boundaries and part headers around the image
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+
+# Per-client rate limiting: each API key (or IP) gets a token bucket of
+# RATE_LIMIT_BURST tokens refilled at RATE_LIMIT_RATE per second. Only the
+# comma-separated RATE_LIMIT_API_KEYS are honoured; other callers are keyed
+# by IP. Buckets are per worker unless RATE_LIMIT_REDIS_URL points at a
+# shared Redis.
+# RATE_LIMIT_TRUSTED_PROXY_HOPS is how many proxies append to X-Forwarded-For.
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') == '1'
+RATE_LIMIT_RATE = float(os.getenv('RATE_LIMIT_RATE', '1'))
+RATE_LIMIT_BURST = float(os.getenv('RATE_LIMIT_BURST', '20'))
+RATE_LIMIT_BATCH_COST = float(os.getenv('RATE_LIMIT_BATCH_COST', '10'))
+RATE_LIMIT_LOOKUP_COST = float(os.getenv('RATE_LIMIT_LOOKUP_COST', '0.2'))
+# Submitting a bulk job; polling and fetching results are not limited
+RATE_LIMIT_JOB_COST = float(os.getenv('RATE_LIMIT_JOB_COST', str(RATE_LIMIT_BATCH_COST)))
+RATE_LIMIT_REDIS_URL = os.getenv('RATE_LIMIT_REDIS_URL')
+RATE_LIMIT_TRUSTED_PROXY_HOPS = int(os.getenv('RATE_LIMIT_TRUSTED_PROXY_HOPS', '1'))
+RATE_LIMIT_API_KEYS = [key.strip() for key in os.getenv('RATE_LIMIT_API_KEYS', '').split(',') if key.strip()]
+
+if RATE_LIMIT_REDIS_URL:
+    rate_limit_store = RedisBucketStore.from_url(RATE_LIMIT_REDIS_URL)
+else:
+    rate_limit_store = InMemoryBucketStore()
+
+# WebSocket monitoring: frames whose perceptual hash is within
+# MONITOR_UNCHANGED_BITS of the last processed frame are skipped, and
+# scores are smoothed over the last MONITOR_WINDOW processed frames
+MONITOR_MAX_CONNECTIONS = int(os.getenv('MONITOR_MAX_CONNECTIONS', '16'))
+MONITOR_WINDOW = int(os.getenv('MONITOR_WINDOW', '10'))
+MONITOR_UNCHANGED_BITS = int(os.getenv('MONITOR_UNCHANGED_BITS', '2'))
+
+monitor_connections = 0
+
+# Batch endpoint configuration
+BATCH_MAX_IMAGES = int(os.getenv('BATCH_MAX_IMAGES', '500'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '8'))
+BATCH_MAX_IMAGE_BYTES = int(os.getenv('BATCH_MAX_IMAGE_BYTES', str(20 * 1024 * 1024)))
+BATCH_MAX_ZIP_BYTES = int(os.getenv('BATCH_MAX_ZIP_BYTES', str(1024 * 1024 * 1024)))
+
+# Bulk jobs: images are spooled under JOBS_DIR with progress and results in
+# a SQLite database there, and JOBS_CONCURRENCY background workers per
+# process run them through the normal prediction path. Finished jobs older
+# than JOBS_RETENTION_HOURS are purged every JOBS_PURGE_INTERVAL_SECONDS
+JOBS_DIR = os.getenv('JOBS_DIR', 'jobs_data')
+JOBS_CONCURRENCY = int(os.getenv('JOBS_CONCURRENCY', '4'))
+JOBS_MAX_IMAGES = int(os.getenv('JOBS_MAX_IMAGES', '10000'))
+JOBS_MAX_BACKLOG = int(os.getenv('JOBS_MAX_BACKLOG', '50000'))
+JOBS_LEASE_SECONDS = float(os.getenv('JOBS_LEASE_SECONDS', '90'))
+JOBS_RETENTION_HOURS = float(os.getenv('JOBS_RETENTION_HOURS', '72'))
+JOBS_PURGE_INTERVAL_SECONDS = float(os.getenv('JOBS_PURGE_INTERVAL_SECONDS', '600'))
+JOBS_STREAM_POLL_INTERVAL = 1.0
+
+job_store = None
+job_runner = None
+
+# Identical images that arrive together share one upstream call
+inflight_predictions = SingleFlight()
+
+# Metrics, exported in Prometheus format on /metrics
+metrics_registry = Registry()
+request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Time from request arrival to response completion",
+    LATENCY_BUCKETS,
+    labelnames=("method", "path", "status"),
+    registry=metrics_registry,
+)
+stage_duration = Histogram(
+    "predict_stage_duration_seconds",
+    "Time spent in each stage of the prediction path",
+    LATENCY_BUCKETS,
+    labelnames=("stage",),
+    registry=metrics_registry,
+)
+upload_size = Histogram(
+    "predict_upload_bytes",
+    "Size of uploaded images",
+    SIZE_BUCKETS,
+    registry=metrics_registry,
+)
+upstream_payload_size = Histogram(
+    "upstream_request_bytes",
+    "Size of image payloads sent to the inference API",
+    SIZE_BUCKETS,
+    registry=metrics_registry,
+)
+requests_shed = Counter(
+    "admission_shed",
+    "Predictions rejected by admission control, by reason",
+    labelnames=("reason",),
+    registry=metrics_registry,
+)
+Gauge(
+    "admission_in_flight",
+    "Predictions currently holding an admission slot",
+    registry=metrics_registry,
+    function=lambda: admission.in_flight,
+)
+Gauge(
+    "admission_queue_depth",
+    "Predictions waiting for an admission slot",
+    registry=metrics_registry,
+    function=lambda: admission.queue_depth,
+)
+cache_outcomes = Counter(
+    "prediction_cache_outcomes",
+    "Prediction lookups by outcome (HIT, HIT-STORE, HIT-NEAR, COALESCED, MISS)",
+    labelnames=("outcome",),
+    registry=metrics_registry,
+)
+monitor_frames = Counter(
+    "monitor_frames",
+    "WebSocket monitor frames by outcome (processed, dropped, unchanged, rejected)",
+    labelnames=("outcome",),
+    registry=metrics_registry,
+)
+Gauge(
+    "monitor_connections",
+    "Open WebSocket monitor connections",
+    registry=metrics_registry,
+    function=lambda: monitor_connections,
+)
+hash_lookups = Counter(
+    "prediction_hash_lookups",
+    "Hash-first lookups by outcome (HIT, HIT-STORE, MISS)",
+    labelnames=("outcome",),
+    registry=metrics_registry,
+)
+Gauge(
+    "prediction_cache_entries",
+    "Entries in the in-memory prediction cache",
+    registry=metrics_registry,
+    function=lambda: len(prediction_cache),
+)
+Gauge(
+    "predictions_in_flight",
+    "Distinct predictions currently being resolved",
+    registry=metrics_registry,
+    function=inflight_predictions.in_flight,
+)
+Gauge(
+    "preprocess_bytes_saved",
+    "Upload bytes not sent upstream thanks to downscaling",
+    registry=metrics_registry,
+    function=lambda: preprocess_stats.bytes_in - preprocess_stats.bytes_out,
+)
+
+startup_phase = Gauge(
+    "startup_phase_seconds",
+    "Seconds spent in each startup phase (import, preload, load, warmup, ready)",
+    labelnames=("phase",),
+    registry=metrics_registry,
+)
+process_memory_bytes = Gauge(
+    "process_memory_bytes",
+    "Resident memory of this worker (rss, pss, uss = unique to this process)",
+    labelnames=("kind",),
+    registry=metrics_registry,
+)
+for kind in ("rss", "pss", "uss"):
+    process_memory_bytes.labels(kind).set_function(
+        lambda kind=kind: metrics.process_memory().get(kind, 0))
+Gauge(
+    "inference_ready",
+    "1 once the inference backend is loaded and warmed up",
+    registry=metrics_registry,
+    function=lambda: int(inference_warm),
+)
+
+uploads_rejected = Counter(
+    "uploads_rejected",
+    "Uploads refused during validation, by HTTP status",
+    labelnames=("status",),
+    registry=metrics_registry,
+)
+rate_limited = Counter(
+    "rate_limited",
+    "Requests rejected by the per-client rate limiter",
+    registry=metrics_registry,
+)
+rate_limit_errors = Counter(
+    "rate_limit_store_errors",
+    "Rate limit checks skipped because the bucket store failed",
+    registry=metrics_registry,
+)
+
+RATE_LIMIT_COSTS = {
+    "/predict": 1,
+    "/predict/batch": RATE_LIMIT_BATCH_COST,
+    "/predict/lookup": RATE_LIMIT_LOOKUP_COST,
+    "/jobs": {"POST": RATE_LIMIT_JOB_COST},
+}
+
+if RATE_LIMIT_ENABLED:
+    # Middleware is only instantiated on the first request; fail at startup instead
+    validate_limits(RATE_LIMIT_RATE, RATE_LIMIT_BURST, RATE_LIMIT_COSTS)
+    # Runs before routing, so rejected uploads are never read or parsed
+    app.add_middleware(
+        RateLimitMiddleware,
+        store=rate_limit_store,
+        rate=RATE_LIMIT_RATE,
+        burst=RATE_LIMIT_BURST,
+        costs=RATE_LIMIT_COSTS,
+        trusted_proxy_hops=RATE_LIMIT_TRUSTED_PROXY_HOPS,
+        api_keys=RATE_LIMIT_API_KEYS,
+        on_reject=rate_limited.inc,
+        on_error=rate_limit_errors.inc,
+    )
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits={
+        "/predict": PREDICT_MAX_IMAGE_BYTES + MULTIPART_OVERHEAD_BYTES,
+        "/predict/batch": BATCH_MAX_ZIP_BYTES,
+        "/jobs": BATCH_MAX_ZIP_BYTES,
+    },
+)
+app.add_middleware(RequestTimingMiddleware, histogram=request_duration)
+
+def build_backend(kind):
+    """Inference backend for INFERENCE_BACKEND, registering its metrics"""
+    if kind == 'remote':
+        return RemoteBackend(
+            HF_API_URL,
+            model_id=MODEL_ID,
+            token=HF_TOKEN,
+            pool_size=HF_POOL_SIZE,
+            keepalive_connections=HF_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HF_KEEPALIVE_EXPIRY,
+            connect_timeout=HF_CONNECT_TIMEOUT,
+            read_timeout=HF_READ_TIMEOUT,
+            pool_timeout=HF_POOL_TIMEOUT,
+            http2=HF_HTTP2,
+            deadline=UPSTREAM_DEADLINE,
+            max_retries=UPSTREAM_MAX_RETRIES,
+            retry_base_delay=UPSTREAM_RETRY_BASE_DELAY,
+            retry_max_delay=UPSTREAM_RETRY_MAX_DELAY,
+            breaker=CircuitBreaker(
+                failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                reset_timeout=CIRCUIT_RESET_TIMEOUT,
+            ),
+            retry_budget=RetryBudget(ratio=RETRY_BUDGET_RATIO),
+            registry=metrics_registry,
+        )
+    if kind == 'local':
+        return LocalBackend(
+            MODEL_ID,
+            runtime=INFERENCE_RUNTIME,
+            token=HF_TOKEN,
+            torch_dtype=LOCAL_TORCH_DTYPE,
+            trust_remote_code=LOCAL_TRUST_REMOTE_CODE,
+            mmap_weights=LOCAL_WEIGHTS_MMAP,
+            onnx_model_dir=ONNX_MODEL_DIR,
+            onnx_quantized=ONNX_QUANTIZED,
+            executor_kind=INFERENCE_EXECUTOR,
+            executor_workers=INFERENCE_WORKERS,
+            max_concurrency=INFERENCE_MAX_CONCURRENCY,
+            torch_threads=TORCH_NUM_THREADS,
+            interop_threads=TORCH_INTEROP_THREADS,
+            batch_max_size=BATCH_MAX_SIZE,
+            batch_max_wait=BATCH_MAX_WAIT_MS / 1000,
+            idle_unload_after=LOCAL_IDLE_UNLOAD_SECONDS,
+            registry=metrics_registry,
+        )
+    if kind == 'hybrid':
+        return HybridBackend(
+            [build_backend('local'), build_backend('remote')],
+            hedge=HEDGE_ENABLED,
+            hedge_min_delay=HEDGE_MIN_DELAY_MS / 1000,
+            hedge_max_delay=HEDGE_MAX_DELAY_MS / 1000,
+            hedge_ratio=HEDGE_BUDGET_RATIO,
+            window=ROUTING_WINDOW,
+            explore=ROUTING_EXPLORE,
+            failure_cooldown=ROUTING_FAILURE_COOLDOWN_SECONDS,
+            registry=metrics_registry,
+        )
+    if kind == 'cascade':
+        if CASCADE_SECOND == 'cascade':
+            raise ValueError("CASCADE_SECOND cannot be cascade")
+        first = LocalBackend(
+            CASCADE_FIRST_MODEL,
+            name='cascade-first',
+            runtime=CASCADE_FIRST_RUNTIME,
+            token=HF_TOKEN,
+            onnx_model_dir=ONNX_MODEL_DIR,
+            onnx_quantized=CASCADE_FIRST_QUANTIZED,
+            torch_threads=TORCH_NUM_THREADS,
+            interop_threads=TORCH_INTEROP_THREADS,
+            batch_max_size=BATCH_MAX_SIZE,
+            batch_max_wait=BATCH_MAX_WAIT_MS / 1000,
+        )
+        return CascadeBackend(
+            first,
+            build_backend(CASCADE_SECOND),
+            min_score=CASCADE_MIN_SCORE,
+            min_margin=CASCADE_MIN_MARGIN,
+            audit_rate=CASCADE_AUDIT_RATE,
+            registry=metrics_registry,
+        )
+    raise ValueError(f"Unknown INFERENCE_BACKEND: {kind}")
+
+inference_backend = build_backend(INFERENCE_BACKEND)
+# Cache and store entries are keyed by what produced them, so answers from
+# a cheaper stand-in (ONNX int8, the cascade) never pass for MODEL_ID's
+PREDICTION_MODEL_KEY = inference_backend.model_key
+
+def record_startup_phase(phase, seconds):
+    startup_timings[phase] = round(seconds, 3)
+    startup_phase.labels(phase).set(seconds)
+
+def warmup_payload():
+    """Small synthetic JPEG shaped like a preprocessed upload"""
+    buffer = io.BytesIO()
+    Image.new('RGB', (PREPROCESS_TARGET_SIZE, PREPROCESS_TARGET_SIZE), (70, 130, 150)).save(
+        buffer, format='JPEG', quality=PREPROCESS_JPEG_QUALITY)
+    return buffer.getvalue()
+
+async def warm_up_backend():
+    """Load the backend, run a dummy prediction, then mark the service ready"""
+    global inference_warm
+    started = time.perf_counter()
+    await inference_backend.start()
+    record_startup_phase("load", time.perf_counter() - started)
+    if not inference_backend.ready:
+        logger.error("Inference backend failed to start; /ready will keep failing")
+        return
+    if WARMUP_ENABLED:
+        started = time.perf_counter()
+        try:
+            await inference_backend.warmup(warmup_payload())
+        except Exception as e:
+            # Still servable, just with a slower first request
+            logger.warning(f"Warmup prediction failed: {str(e)}")
+        record_startup_phase("warmup", time.perf_counter() - started)
+    inference_warm = True
+    record_startup_phase("ready", time.perf_counter() - IMPORT_STARTED)
+    logger.info(f"Inference ready ({INFERENCE_BACKEND}): {startup_timings}")
+
+def preload_inference_backend():
+    """Load the model before the server forks workers (called from gunicorn.conf.py)"""
+    started = time.perf_counter()
+    inference_backend.preload()
+    record_startup_phase("preload", time.perf_counter() - started)
+
+@app.on_event("startup")
+async def start_inference_backend():
+    """Start loading the backend in the background so the server comes up at once"""
+    global warmup_task
+    record_startup_phase("import", time.perf_counter() - IMPORT_STARTED)
+    warmup_task = asyncio.create_task(warm_up_backend())
+
+@app.on_event("startup")
+async def open_prediction_store():
+    """Open the persistent prediction store if one is configured"""
+    global prediction_store
+    if not PREDICTION_STORE_PATH:
+        return
+    try:
+        prediction_store = await asyncio.to_thread(
+            PredictionStore,
+            PREDICTION_STORE_PATH,
+            max_entries=PREDICTION_STORE_MAX_ENTRIES,
+        )
+        logger.info(f"Prediction store opened at {PREDICTION_STORE_PATH}")
+    except Exception as e:
+        logger.error(f"Failed to open prediction store: {str(e)}")
+
+@app.on_event("startup")
+async def start_job_runner():
+    """Open the job queue and resume any unfinished work; expired jobs are purged periodically"""
+    global job_store, job_runner
+    try:
+        job_store = await asyncio.to_thread(
+            JobStore,
+            os.path.join(JOBS_DIR, "jobs.db"),
+            os.path.join(JOBS_DIR, "spool"),
+        )
+    except Exception as e:
+        logger.error(f"Failed to open job store: {str(e)}")
+        job_store = None
+        return
+    job_runner = JobRunner(
+        job_store,
+        predict_batch_entry,
+        concurrency=JOBS_CONCURRENCY,
+        lease_seconds=JOBS_LEASE_SECONDS,
+        retention=JOBS_RETENTION_HOURS * 3600,
+        purge_interval=JOBS_PURGE_INTERVAL_SECONDS,
+    )
+    job_runner.start()
+    logger.info(f"Job runner started with {JOBS_CONCURRENCY} workers ({JOBS_DIR})")
+
+@app.on_event("shutdown")
+async def stop_job_runner():
+    """Stop job workers, returning in-progress images to the queue"""
+    global job_store, job_runner
+    if job_runner is not None:
+        await job_runner.stop()
+        job_runner = None
+    if job_store is not None:
+        job_store.close()
+        job_store = None
+
+@app.on_event("shutdown")
+async def stop_inference_backend():
+    """Close upstream connections and stop local inference workers"""
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await warmup_task
+    await inference_backend.stop()
+
+@app.on_event("shutdown")
+async def close_prediction_store():
+    """Close the persistent prediction store"""
+    global prediction_store
+    if prediction_store is not None:
+        prediction_store.close()
+        prediction_store = None
+
+@app.on_event("shutdown")
+async def close_rate_limit_store():
+    """Close the shared rate limit backend, if any"""
+    if isinstance(rate_limit_store, RedisBucketStore):
+        await rate_limit_store.close()
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -40,8 +661,8 @@ async def root():
         content={
             "status": "online",
             "message": "Fish Disease Classifier API is running",
-            "model_loaded": True,
-            "using": "HuggingFace Inference API"
+            "model_loaded": inference_backend.ready,
+            "using": INFERENCE_BACKEND
         },
         headers={
             "Access-Control-Allow-Origin": "*",
@@ -50,104 +671,295 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """Detailed health check"""
+    """Liveness check: answers as soon as the server is up, whatever the backend state"""
     return JSONResponse(
         content={
-            "status": "healthy",
-            "model_loaded": True,
-            "using": "HuggingFace Inference API"
+            "status": "healthy" if inference_warm else "warming_up",
+            "model_loaded": inference_backend.ready,
+            "ready": inference_warm,
+            "backend_available": inference_backend.available(),
+            "using": INFERENCE_BACKEND
         },
         headers={
             "Access-Control-Allow-Origin": "*",
         }
     )
 
-@app.post("/predict")
-async def predict_image(file: UploadFile = File(...)):
-    """Predict fish disease from uploaded image using HuggingFace Inference API"""
-    try:
-        # Validate file type
-        if not file.content_type.startswith('image/'):
-            raise HTTPException(
-                status_code=400,
-                detail="File must be an image"
-            )
-        
-        logger.info(f"Processing image: {file.filename}")
-        
-        # Read uploaded file
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-        
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Convert image to bytes for API
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format='JPEG')
-        img_byte_arr = img_byte_arr.getvalue()
-        
-        # Call HuggingFace Inference API
-        headers = {}
-        if HF_TOKEN:
-            headers["Authorization"] = f"Bearer {HF_TOKEN}"
-        
-        logger.info("Calling HuggingFace Inference API...")
-        response = requests.post(
-            HF_API_URL,
-            headers=headers,
-            data=img_byte_arr,
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            logger.error(f"HuggingFace API error: {response.status_code} - {response.text}")
-            raise HTTPException(
-                status_code=503,
-                detail=f"Model inference failed: {response.text}"
-            )
-        
-        preds = response.json()
-        logger.info(f"Predictions: {preds}")
-        
-        # Prepare results
-        fish_preds = [
-            pred for pred in preds
-            if pred["label"].startswith("Fish_")
-        ]
-        
-        if not fish_preds:
-            # If no fish predictions, return top prediction anyway
-            top_prediction = preds[0] if preds else None
-            if not top_prediction:
-                raise HTTPException(
-                    status_code=500,
-                    detail="No predictions returned from model"
-                )
-            return JSONResponse(
-                content={
-                    "label": top_prediction["label"],
-                    "score": float(top_prediction["score"])
-                },
-                headers={
-                    "Access-Control-Allow-Origin": "*",
-                }
-            )
-        
-        top_fish = fish_preds[0]
-        
+@app.get("/ready")
+async def readiness_check():
+    """Readiness check: 200 only once the backend is loaded and warmed up"""
+    if inference_warm:
         return JSONResponse(
             content={
-                "label": top_fish["label"],
-                "score": float(top_fish["score"])
+                "status": "ready",
+                "using": INFERENCE_BACKEND,
+                "startup_seconds": startup_timings
             },
             headers={
                 "Access-Control-Allow-Origin": "*",
             }
         )
+    failed = warmup_task is not None and warmup_task.done()
+    return JSONResponse(
+        status_code=503,
+        content={
+            "status": "failed" if failed else "warming_up",
+            "using": INFERENCE_BACKEND,
+            "startup_seconds": startup_timings
+        },
+        headers={
+            "Access-Control-Allow-Origin": "*",
+            "Retry-After": "5",
+        }
+    )
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics for this worker"""
+    return PlainTextResponse(
+        metrics_registry.render(),
+        media_type=metrics.CONTENT_TYPE
+    )
+
+@app.get("/stats")
+async def stats():
+    """Cache statistics for this worker"""
+    jobs_stats = None
+    if job_runner:
+        # The backlog count is a SQLite query; keep it off the event loop
+        jobs_stats = {**await asyncio.to_thread(job_store.stats), **job_runner.stats()}
+    return JSONResponse(
+        content={
+            "cache": prediction_cache.stats(),
+            "store": prediction_store.stats() if prediction_store else None,
+            "coalescing": inflight_predictions.stats(),
+            "preprocessing": preprocess_stats.stats(),
+            "near_duplicates": phash_index.stats() if phash_index else None,
+            "admission": admission.stats(),
+            "jobs": jobs_stats,
+            "rate_limit": {
+                "enabled": RATE_LIMIT_ENABLED,
+                "rate_per_second": RATE_LIMIT_RATE,
+                "burst": RATE_LIMIT_BURST,
+                **rate_limit_store.stats()
+            },
+            "backend": inference_backend.stats(),
+            "startup_seconds": startup_timings,
+            "memory": metrics.process_memory()
+        },
+        headers={
+            "Access-Control-Allow-Origin": "*",
+        }
+    )
+
+def summarize_predictions(preds):
+    """Pick the top fish prediction, falling back to the overall top one"""
+    # Prepare results
+    fish_preds = [
+        pred for pred in preds
+        if pred["label"].startswith("Fish_")
+    ]
+    
+    if not fish_preds:
+        # If no fish predictions, return top prediction anyway
+        top_prediction = preds[0] if preds else None
+        if not top_prediction:
+            raise HTTPException(
+                status_code=500,
+                detail="No predictions returned from model"
+            )
+        return {
+            "label": top_prediction["label"],
+            "score": float(top_prediction["score"])
+        }
+    
+    top_fish = fish_preds[0]
+    
+    return {
+        "label": top_fish["label"],
+        "score": float(top_fish["score"])
+    }
+
+async def preprocess_upload(contents, timer):
+    """Decode and shrink an upload off the event loop"""
+    with timer.stage("preprocess"):
+        prepared = await asyncio.to_thread(
+            prepare_image,
+            contents,
+            target_size=PREPROCESS_TARGET_SIZE,
+            passthrough_max_side=PREPROCESS_PASSTHROUGH_MAX_SIDE,
+            quality=PREPROCESS_JPEG_QUALITY,
+            compute_dhash=phash_index is not None,
+        )
+    preprocess_stats.record(prepared)
+    upstream_payload_size.observe(prepared.bytes_out)
+    logger.info(
+        f"Prepared image {prepared.original_size} -> {prepared.size} "
+        f"({prepared.strategy}, {prepared.bytes_in} -> {prepared.bytes_out} bytes)"
+    )
+    return prepared
+
+async def query_model(contents, timer, prepared=None):
+    """Run uploaded image bytes through the configured inference backend"""
+    prepared = prepared or await preprocess_upload(contents, timer)
+    preds = await inference_backend.classify(prepared.payload, timer)
+    logger.info(f"Predictions: {preds}")
+    return preds
+
+def parse_digest(value):
+    """Normalise a client-supplied SHA-256 (bare, quoted ETag or sha256:-prefixed)"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    value = value.strip('"').lower()
+    if value.startswith("sha256:"):
+        value = value[len("sha256:"):]
+    if len(value) != 64 or any(c not in "0123456789abcdef" for c in value):
+        return None
+    return value
+
+async def lookup_prediction(digest, timer):
+    """Cached (predictions, cache_status) for an image hash, or (None, "MISS")"""
+    key = cache_key(digest, PREDICTION_MODEL_KEY)
+    with timer.stage("cache"):
+        preds = prediction_cache.get(key)
+    if preds is not None:
+        return preds, "HIT"
+    if prediction_store is not None:
+        with timer.stage("store"):
+            preds = await asyncio.to_thread(prediction_store.get, digest, PREDICTION_MODEL_KEY)
+        if preds is not None:
+            prediction_cache.set(key, preds)
+            return preds, "HIT-STORE"
+    return None, "MISS"
+
+async def resolve_cache_miss(contents, digest, key, timer):
+    """Fetch predictions from the persistent store or the model"""
+    if prediction_store is not None:
+        with timer.stage("store"):
+            preds = await asyncio.to_thread(prediction_store.get, digest, PREDICTION_MODEL_KEY)
+        if preds is not None:
+            prediction_cache.set(key, preds)
+            return preds, "HIT-STORE"
+    
+    prepared = await preprocess_upload(contents, timer)
+    if phash_index is not None:
+        with timer.stage("near"):
+            match = phash_index.find(prepared.dhash)
+        if match is not None:
+            near_digest, distance = match
+            preds, _ = await lookup_prediction(near_digest, timer)
+            if preds is not None:
+                logger.info(f"Near-duplicate of {near_digest[:12]} (distance {distance})")
+                # Memory only: a wrong near match must not outlive the cache TTL
+                prediction_cache.set(key, preds)
+                return preds, "HIT-NEAR"
+    
+    preds = await query_model(contents, timer, prepared)
+    # A stopgap answer (e.g. the cascade's cheap model when escalation
+    # failed) serves this request only
+    if preds and not isinstance(preds, ProvisionalPredictions):
+        prediction_cache.set(key, preds)
+        if prediction_store is not None:
+            await asyncio.to_thread(prediction_store.put, digest, PREDICTION_MODEL_KEY, preds)
+        if phash_index is not None:
+            phash_index.add(prepared.dhash, digest)
+    return preds, "MISS"
+
+async def classify_contents(contents, timer=None, digest=None):
+    """Return (predictions, cache_status) for raw image bytes"""
+    timer = timer or StageTimer(stage_duration)
+    with timer.stage("cache"):
+        digest = digest or image_digest(contents)
+        key = cache_key(digest, PREDICTION_MODEL_KEY)
+        preds = prediction_cache.get(key)
+    if preds is not None:
+        cache_outcomes.labels("HIT").inc()
+        return preds, "HIT"
+    
+    # Concurrent requests for the same image wait on a single lookup
+    started = time.perf_counter()
+    (preds, cache_status), shared = await inflight_predictions.do(
+        key, resolve_cache_miss, contents, digest, key, timer
+    )
+    if shared:
+        timer.add("coalesced", time.perf_counter() - started)
+        cache_status = "COALESCED"
+    cache_outcomes.labels(cache_status).inc()
+    return preds, cache_status
+
+def prediction_response(preds, cache_status, digest, timer, received_at):
+    """JSON response for one classified image; the ETag is the image's SHA-256"""
+    with timer.stage("postprocess"):
+        result = summarize_predictions(preds)
+    total = time.perf_counter() - received_at if received_at is not None else None
+    
+    return JSONResponse(
+        content=result,
+        headers={
+            "Access-Control-Allow-Origin": "*",
+            "X-Cache": cache_status,
+            "ETag": f'"{digest}"',
+            "Server-Timing": timer.server_timing(total),
+            "Timing-Allow-Origin": "*",
+        }
+    )
+
+async def predict_upload(filename, chunks, timer, received_at, claimed_digest=None):
+    """Shared single-image path: admission, bounded read, classification, response.
+
+    When the client announces the image hash up front and it is already
+    cached, the result is returned without reading the body at all.
+    """
+    try:
+        logger.info(f"Processing image: {filename}")
+        
+        if claimed_digest:
+            preds, cache_status = await lookup_prediction(claimed_digest, timer)
+            hash_lookups.labels(cache_status).inc()
+            if preds is not None:
+                cache_outcomes.labels(cache_status).inc()
+                return prediction_response(preds, cache_status, claimed_digest, timer, received_at)
+        
+        # Wait for an admission slot before buffering the image
+        queued_at = time.perf_counter()
+        async with admission.slot():
+            timer.add("queue", time.perf_counter() - queued_at)
+            
+            # Read in chunks, stopping early on oversized or non-image data,
+            # then check the header before anything is decoded
+            with timer.stage("read"):
+                contents = await read_limited(chunks, PREDICT_MAX_IMAGE_BYTES)
+                check_image_header(contents, IMAGE_MAX_PIXELS)
+            upload_size.observe(len(contents))
+            digest = image_digest(contents)
+            if claimed_digest and digest != claimed_digest:
+                raise UploadRejected(400, "Image does not match X-Content-SHA256")
+            preds, cache_status = await classify_contents(contents, timer, digest)
         
-    except HTTPException:
+        return prediction_response(preds, cache_status, digest, timer, received_at)
+        
+    except Overloaded as e:
+        requests_shed.labels(e.reason).inc()
+        logger.warning(f"Shedding request: {e.reason}")
+        raise HTTPException(
+            status_code=e.status_code,
+            detail="Server is busy, please retry later",
+            headers={"Retry-After": e.retry_after_header}
+        )
+    except UploadRejected as e:
+        uploads_rejected.labels(e.status_code).inc()
+        logger.warning(f"Rejected upload {filename}: {e.detail}")
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail
+        )
+    except StarletteHTTPException as e:
+        # Also covers BodySizeLimitMiddleware cutting off a streamed body
+        if e.status_code == 413:
+            uploads_rejected.labels(413).inc()
         raise
     except Exception as e:
         logger.error(f"Error processing image: {str(e)}")
@@ -156,3 +968,462 @@ async def predict_image(file: UploadFile = File(...)):
             status_code=500,
             detail=f"Error processing image: {str(e)}"
         )
+
+@app.post("/predict")
+async def predict_image(request: Request, file: UploadFile = File(...)):
+    """Predict fish disease from uploaded image using HuggingFace Inference API"""
+    timer = StageTimer(stage_duration)
+    # Lets RequestTimingMiddleware report the stages on error responses too
+    request.state.timer = timer
+    received_at = getattr(request.state, "received_at", None)
+    if received_at is not None:
+        # Multipart parsing happens before the handler is called
+        timer.add("parse", time.perf_counter() - received_at)
+    
+    # Validate file type
+    if not file.content_type.startswith('image/'):
+        raise HTTPException(
+            status_code=400,
+            detail="File must be an image"
+        )
+    
+    claimed_digest = parse_digest(request.headers.get("x-content-sha256"))
+    return await predict_upload(file.filename, iter_upload(file), timer, received_at,
+                                claimed_digest)
+
+@app.post("/predict/raw")
+async def predict_raw(request: Request):
+    """Predict from an image sent as the raw request body (no multipart).
+
+    The body is streamed straight into the same bounded reader /predict
+    uses, so nothing is spooled or parsed first. X-Filename optionally
+    names the image in logs. With X-Content-SHA256 and
+    "Expect: 100-continue", a cached image is answered before the client
+    sends the body.
+    """
+    timer = StageTimer(stage_duration)
+    # Lets RequestTimingMiddleware report the stages on error responses too
+    request.state.timer = timer
+    received_at = getattr(request.state, "received_at", None)
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type != "application/octet-stream" and not content_type.startswith("image/"):
+        raise HTTPException(
+            status_code=415,
+            detail="Body must be application/octet-stream or image/*"
+        )
+    
+    filename = request.headers.get("x-filename", "raw upload")
+    claimed_digest = parse_digest(request.headers.get("x-content-sha256"))
+    return await predict_upload(filename, request.stream(), timer, received_at,
+                                claimed_digest)
+
+@app.get("/predict/lookup/{digest}")
+async def predict_lookup(request: Request, digest: str):
+    """Hash-first protocol: the cached result for an image's SHA-256, or 404.
+
+    Clients send the hash of the image they are about to upload and only
+    upload it (to /predict or /predict/raw) on a 404. If-None-Match with
+    the same hash turns a hit into 304 for clients that already hold the
+    result.
+    """
+    timer = StageTimer(stage_duration)
+    # Lets RequestTimingMiddleware report the stages on error responses too
+    request.state.timer = timer
+    received_at = getattr(request.state, "received_at", None)
+    normalized = parse_digest(digest)
+    if normalized is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Digest must be a hex SHA-256 of the image bytes"
+        )
+    
+    preds, cache_status = await lookup_prediction(normalized, timer)
+    hash_lookups.labels(cache_status).inc()
+    if preds is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Image not cached, upload it to /predict"
+        )
+    if parse_digest(request.headers.get("if-none-match")) == normalized:
+        return Response(
+            status_code=304,
+            headers={
+                "Access-Control-Allow-Origin": "*",
+                "ETag": f'"{normalized}"',
+            }
+        )
+    return prediction_response(preds, cache_status, normalized, timer, received_at)
+
+def collect_batch_uploads(files, max_images=BATCH_MAX_IMAGES):
+    """Index batch uploads as [(filename, BatchImage, error)], expanding zip archives.
+
+    Only each upload's first bytes and each archive's directory are read
+    here; the images stay in the uploads' spooled files until processed.
+    Blocking, so run it in a thread.
+    """
+    entries = []
+    for file in files:
+        head = peek(file.file)
+        if is_zip_upload(file.filename, file.content_type, head):
+            images = list_zip_images(
+                file.file,
+                max_images=max_images,
+                max_entry_bytes=BATCH_MAX_IMAGE_BYTES,
+                max_total_bytes=BATCH_MAX_ZIP_BYTES,
+            )
+            entries.extend((image.filename, image, None) for image in images)
+        elif not (file.content_type or '').startswith('image/'):
+            entries.append((file.filename, None, "File must be an image"))
+        elif not head:
+            entries.append((file.filename, None, "Upload is empty"))
+        else:
+            image = UploadedImage(file.file, file.filename, BATCH_MAX_IMAGE_BYTES)
+            entries.append((file.filename, image, None))
+        if len(entries) > max_images:
+            raise ValueError(f"Batch contains more than {max_images} images")
+    return entries
+
+async def predict_batch_entry(index, filename, contents, error=None, semaphore=None):
+    """Classify one batch entry, returning its NDJSON record.
+
+    contents is the image bytes or a BatchImage; a BatchImage is read only
+    once the semaphore admits it, so at most that many images are in
+    memory at a time.
+    """
+    record = {"index": index, "filename": filename}
+    if error:
+        record.update({"error": error, "status": 400})
+        return record
+    async with semaphore or contextlib.nullcontext():
+        try:
+            if isinstance(contents, BatchImage):
+                contents = await asyncio.to_thread(contents.read)
+            check_image_header(contents, IMAGE_MAX_PIXELS)
+        except UploadRejected as e:
+            uploads_rejected.labels(e.status_code).inc()
+            record.update({"error": e.detail, "status": e.status_code})
+            return record
+        try:
+            async with admission.slot():
+                preds, cache_status = await classify_contents(contents)
+            record.update(summarize_predictions(preds))
+            record["cache"] = cache_status
+        except Overloaded as e:
+            requests_shed.labels(e.reason).inc()
+            record.update({"error": "Server is busy, please retry later",
+                           "status": e.status_code, "retry_after": e.retry_after_header})
+        except HTTPException as e:
+            record.update({"error": e.detail, "status": e.status_code})
+        except Exception as e:
+            logger.error(f"Error processing {filename}: {str(e)}")
+            record.update({"error": f"Error processing image: {str(e)}", "status": 500})
+    return record
+
+@app.post("/predict/batch")
+async def predict_batch(files: List[UploadFile] = File(...)):
+    """Classify many images (or a zip of images), streaming one NDJSON line per image"""
+    try:
+        entries = await asyncio.to_thread(collect_batch_uploads, files)
+    except UploadRejected as e:
+        uploads_rejected.labels(e.status_code).inc()
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+    
+    logger.info(f"Processing batch of {len(entries)} images")
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    
+    async def stream_results():
+        tasks = [
+            asyncio.ensure_future(
+                predict_batch_entry(index, filename, contents, error, semaphore)
+            )
+            for index, (filename, contents, error) in enumerate(entries)
+        ]
+        failed = 0
+        try:
+            # Emit each result as soon as it is ready, not in upload order
+            for next_done in asyncio.as_completed(tasks):
+                record = await next_done
+                if "error" in record:
+                    failed += 1
+                yield json.dumps(record) + "\n"
+            yield json.dumps({"done": True, "total": len(entries), "failed": failed}) + "\n"
+        finally:
+            # Client went away: stop work that nobody will read
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(
+        stream_results(),
+        media_type="application/x-ndjson",
+        headers={
+            "Access-Control-Allow-Origin": "*",
+        }
+    )
+
+def require_job_store():
+    if job_store is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Job queue is unavailable"
+        )
+    return job_store
+
+async def get_job_or_404(job_id):
+    job = await asyncio.to_thread(require_job_store().get_job, job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Job not found"
+        )
+    return job
+
+def job_links(job_id):
+    return {
+        "status": f"/jobs/{job_id}",
+        "results": f"/jobs/{job_id}/results",
+        "stream": f"/jobs/{job_id}/stream",
+    }
+
+@app.post("/jobs", status_code=202)
+async def create_job(files: List[UploadFile] = File(...)):
+    """Queue many images (or zips of images) for background classification"""
+    store = require_job_store()
+    try:
+        entries = await asyncio.to_thread(collect_batch_uploads, files, JOBS_MAX_IMAGES)
+    except UploadRejected as e:
+        uploads_rejected.labels(e.status_code).inc()
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+    
+    backlog = await asyncio.to_thread(store.backlog)
+    if backlog + len(entries) > JOBS_MAX_BACKLOG:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many images queued, please retry later",
+            headers={"Retry-After": "60"}
+        )
+    
+    try:
+        # Streams each image from its upload or archive into the spool
+        job_id = await asyncio.to_thread(store.create_job, entries, BATCH_MAX_ZIP_BYTES)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=413,
+            detail=str(e)
+        )
+    job_runner.wake()
+    logger.info(f"Queued job {job_id} with {len(entries)} images")
+    return JSONResponse(
+        status_code=202,
+        content={**await get_job_or_404(job_id), "links": job_links(job_id)},
+        headers={
+            "Access-Control-Allow-Origin": "*",
+            "Location": f"/jobs/{job_id}",
+        }
+    )
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Progress counts for a job"""
+    job = await get_job_or_404(job_id)
+    return JSONResponse(
+        content={**job, "links": job_links(job_id)},
+        headers={
+            "Access-Control-Allow-Origin": "*",
+        }
+    )
+
+@app.get("/jobs/{job_id}/results")
+async def job_results(job_id: str, after: int = 0):
+    """Finished results as NDJSON in completion order; pass ?after=<seq> to page"""
+    store = require_job_store()
+    await get_job_or_404(job_id)
+    
+    async def stream_results():
+        cursor = after
+        while True:
+            records = await asyncio.to_thread(store.results, job_id, cursor)
+            if not records:
+                return
+            for record in records:
+                yield json.dumps(record) + "\n"
+            cursor = records[-1]["seq"]
+    
+    return StreamingResponse(
+        stream_results(),
+        media_type="application/x-ndjson",
+        headers={
+            "Access-Control-Allow-Origin": "*",
+        }
+    )
+
+@app.get("/jobs/{job_id}/stream")
+async def job_stream(job_id: str, after: int = 0):
+    """Follow a job: NDJSON results as they finish, then a final summary line"""
+    store = require_job_store()
+    await get_job_or_404(job_id)
+    
+    async def follow():
+        cursor = after
+        while True:
+            job = await asyncio.to_thread(store.get_job, job_id)
+            records = await asyncio.to_thread(store.results, job_id, cursor)
+            for record in records:
+                yield json.dumps(record) + "\n"
+            if records:
+                cursor = records[-1]["seq"]
+                continue
+            if job is None or job["status"] in ("completed", "cancelled"):
+                yield json.dumps({"done": True, **(job or {"job_id": job_id})}) + "\n"
+                return
+            await asyncio.sleep(JOBS_STREAM_POLL_INTERVAL)
+    
+    return StreamingResponse(
+        follow(),
+        media_type="application/x-ndjson",
+        headers={
+            "Access-Control-Allow-Origin": "*",
+        }
+    )
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a job's remaining images; finished results stay available"""
+    await get_job_or_404(job_id)
+    await asyncio.to_thread(job_store.cancel, job_id)
+    return JSONResponse(
+        content=await get_job_or_404(job_id),
+        headers={
+            "Access-Control-Allow-Origin": "*",
+        }
+    )
+
+async def process_monitor_frame(contents, state, smoother):
+    """Classify one monitor frame; returns the message to send, or None if unchanged"""
+    check_image_header(contents, IMAGE_MAX_PIXELS)
+    frame_hash = await asyncio.to_thread(frame_dhash, contents)
+    if (
+        state["last_hash"] is not None
+        and hamming(frame_hash, state["last_hash"]) <= MONITOR_UNCHANGED_BITS
+    ):
+        return None
+    
+    started = time.perf_counter()
+    async with admission.slot():
+        preds, cache_status = await classify_contents(contents)
+    state["last_hash"] = frame_hash
+    smoother.add(preds)
+    smoothed = smoother.scores()
+    top_label = next(iter(smoothed), None)
+    return {
+        "type": "prediction",
+        **summarize_predictions(preds),
+        "smoothed": {
+            "label": top_label,
+            "score": smoothed.get(top_label),
+            "scores": smoothed,
+            "frames": len(smoother),
+        },
+        "cache": cache_status,
+        "latency_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+
+@app.websocket("/ws/monitor")
+async def monitor_stream(websocket: WebSocket):
+    """Continuous classification of camera frames sent as binary messages.
+
+    Inference always runs on the newest frame: frames that arrive while
+    the previous one is still being classified replace each other and are
+    dropped. Frames visually unchanged from the last classified one are
+    skipped. Each classified frame gets a JSON message with its own top
+    prediction and per-label scores smoothed over ?window= frames.
+    """
+    global monitor_connections
+    if monitor_connections >= MONITOR_MAX_CONNECTIONS:
+        await websocket.close(code=1013, reason="Too many monitor connections")
+        return
+    # Claim the slot before any await so concurrent handshakes can't overshoot
+    monitor_connections += 1
+    tasks = []
+    try:
+        try:
+            window = max(1, min(int(websocket.query_params.get("window", MONITOR_WINDOW)), 100))
+        except ValueError:
+            window = MONITOR_WINDOW
+        await websocket.accept()
+        mailbox = LatestFrame()
+        smoother = ScoreSmoother(window)
+        state = {"last_hash": None}
+        counts = {"processed": 0, "unchanged": 0, "rejected": 0}
+
+        async def receive_frames():
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                frame = message.get("bytes")
+                if frame is None:
+                    continue
+                if len(frame) > PREDICT_MAX_IMAGE_BYTES:
+                    counts["rejected"] += 1
+                    monitor_frames.labels("rejected").inc()
+                    continue
+                if mailbox.put(frame):
+                    monitor_frames.labels("dropped").inc()
+
+        async def process_frames():
+            while True:
+                frame = await mailbox.take()
+                try:
+                    message = await process_monitor_frame(frame, state, smoother)
+                except Overloaded as e:
+                    requests_shed.labels(e.reason).inc()
+                    message = {"type": "error", "status": e.status_code,
+                               "detail": "Server is busy, frame skipped"}
+                except UploadRejected as e:
+                    counts["rejected"] += 1
+                    monitor_frames.labels("rejected").inc()
+                    message = {"type": "error", "status": e.status_code, "detail": e.detail}
+                except HTTPException as e:
+                    message = {"type": "error", "status": e.status_code, "detail": e.detail}
+                except Exception as e:
+                    logger.error(f"Error processing monitor frame: {str(e)}")
+                    message = {"type": "error", "status": 500,
+                               "detail": f"Error processing image: {str(e)}"}
+                if message is None:
+                    counts["unchanged"] += 1
+                    monitor_frames.labels("unchanged").inc()
+                    continue
+                if message["type"] == "prediction":
+                    counts["processed"] += 1
+                    monitor_frames.labels("processed").inc()
+                message["frames"] = {**counts, "received": mailbox.received, "dropped": mailbox.dropped}
+                await websocket.send_json(message)
+
+        receiver = asyncio.ensure_future(receive_frames())
+        processor = asyncio.ensure_future(process_frames())
+        tasks = [receiver, processor]
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                if not isinstance(task.exception(), WebSocketDisconnect):
+                    logger.error(f"Monitor stream failed: {str(task.exception())}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        monitor_connections -= 1
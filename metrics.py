@@ -0,0 +1,313 @@
+"""Lightweight in-process metrics with Prometheus text exposition"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers cache hits (microseconds) up to slow upstream calls
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+# Bytes; from thumbnails up to full-resolution phone photos
+SIZE_BUCKETS = [1024, 4096, 16384, 65536, 262144, 1048576, 4194304,
+                16777216, 67108864]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Base for metrics that may be split into labelled children"""
+
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=(), registry=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._children_lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        """Child metric for one combination of label values"""
+        values = tuple(str(v) for v in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        child = self._children.get(values)
+        if child is None:
+            with self._children_lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._new_child()
+                    self._children[values] = child
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        """Yield (suffix, labels, value) for every sample of this metric"""
+        if not self.labelnames:
+            yield from self._own_samples({})
+            return
+        for values, child in list(self._children.items()):
+            yield from child._own_samples(dict(zip(self.labelnames, values)))
+
+    def _own_samples(self, labels):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=(), registry=None):
+        super().__init__(name, help, labelnames, registry)
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        return Counter(self.name, self.help)
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def _own_samples(self, labels):
+        yield "_total", labels, self._value
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, or be read from a callback at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=(), registry=None, function=None):
+        super().__init__(name, help, labelnames, registry)
+        self._value = 0.0
+        self._function = function
+
+    def _new_child(self):
+        return Gauge(self.name, self.help)
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        self._value += amount
+
+    def dec(self, amount=1):
+        self._value -= amount
+
+    def set_function(self, function):
+        self._function = function
+
+    @property
+    def value(self):
+        return self._function() if self._function else self._value
+
+    def _own_samples(self, labels):
+        yield "", labels, self.value
+
+
+class Histogram(_Metric):
+    """Cumulative bucketed histogram of observed values"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets, labelnames=(), registry=None):
+        super().__init__(name, help, labelnames, registry)
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        return Histogram(self.name, self.help, self.buckets)
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self):
+        """Cumulative counts per upper bound, plus total count and sum"""
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        cumulative = {}
+        running = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            running += bucket_count
+            cumulative[str(bound)] = running
+        cumulative["+Inf"] = count
+        return {
+            "buckets": cumulative,
+            "count": count,
+            "sum": total,
+            "mean": total / count if count else 0.0,
+        }
+
+    def _own_samples(self, labels):
+        snapshot = self.snapshot()
+        for bound, count in snapshot["buckets"].items():
+            yield "_bucket", {**labels, "le": bound}, count
+        yield "_sum", labels, snapshot["sum"]
+        yield "_count", labels, snapshot["count"]
+
+
+class Registry:
+    """Collection of metrics rendered together on /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def process_memory(pid="self"):
+    """Resident memory of a process in bytes, from /proc/<pid>/smaps_rollup.
+
+    rss counts every resident page, pss splits each shared page evenly
+    between the processes mapping it, and uss counts only pages private to
+    the process (what stopping it would free). Empty where smaps_rollup is
+    unavailable (non-Linux, or kernels before 4.14).
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        return {}
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "swap": fields.get("Swap", 0),
+    }
+
+
+class StageTimer:
+    """Per-request stage durations for Server-Timing and a stage histogram.
+
+    Each finished stage is observed into histogram (labelled by stage) and
+    kept so the response can report it in a Server-Timing header.
+    """
+
+    def __init__(self, histogram=None):
+        self.histogram = histogram
+        self.stages = []
+
+    def add(self, name, seconds):
+        self.stages.append((name, seconds))
+        if self.histogram is not None:
+            self.histogram.labels(name).observe(seconds)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def server_timing(self, total=None):
+        """Server-Timing header value, durations in milliseconds"""
+        parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stages]
+        if total is not None:
+            parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+
+class RequestTimingMiddleware:
+    """ASGI middleware stamping each request with its arrival time.
+
+    The timestamp is stored in request.state.received_at so handlers can
+    tell how long body parsing took before they were called, and total
+    request durations are recorded per route and status code. Responses
+    that don't set Server-Timing themselves (errors, rejections by other
+    middleware) get one with the stages of the StageTimer a handler left
+    in request.state.timer, if any, and the total.
+    """
+
+    def __init__(self, app, histogram=None):
+        self.app = app
+        self.histogram = histogram
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        scope.setdefault("state", {})["received_at"] = start
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                headers = list(message.get("headers", []))
+                if not any(name.lower() == b"server-timing" for name, _ in headers):
+                    timer = scope["state"].get("timer") or StageTimer()
+                    timing = timer.server_timing(time.perf_counter() - start)
+                    headers += [(b"server-timing", timing.encode()), (b"timing-allow-origin", b"*")]
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if self.histogram is not None:
+                route = scope.get("route")
+                path = getattr(route, "path", "unmatched")
+                self.histogram.labels(scope["method"], path, status["code"]).observe(
+                    time.perf_counter() - start)
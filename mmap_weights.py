@@ -0,0 +1,131 @@
+"""Load transformers model weights as memory-mapped, copy-on-write tensors.
+
+from_pretrained reads every weight into anonymous memory, so each worker
+process holds its own private copy of the model. Here the safetensors
+file is mapped copy-on-write (MAP_PRIVATE) and every tensor is a view
+into that mapping. As long as nothing writes to the weights their pages
+belong to the OS page cache: shared by every process that maps the same
+file, read from disk only when touched, and dropped and re-read under
+memory pressure instead of being swapped. Checkpoints that only ship
+pytorch_model.bin are mapped through torch.load(mmap=True) instead.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+
+logger = logging.getLogger(__name__)
+
+SAFETENSORS_FILE = "model.safetensors"
+PYTORCH_WEIGHTS_FILE = "pytorch_model.bin"
+
+_SAFETENSORS_DTYPES = {
+    "F64": "float64",
+    "F32": "float32",
+    "F16": "float16",
+    "BF16": "bfloat16",
+    "I64": "int64",
+    "I32": "int32",
+    "I16": "int16",
+    "I8": "int8",
+    "U8": "uint8",
+    "BOOL": "bool",
+}
+
+
+def resolve_weights_file(model_id, token=None):
+    """Local path of the model's weights, downloading them to the Hub cache if needed"""
+    if os.path.isdir(model_id):
+        for name in (SAFETENSORS_FILE, PYTORCH_WEIGHTS_FILE):
+            path = os.path.join(model_id, name)
+            if os.path.exists(path):
+                return path
+        raise FileNotFoundError(f"No {SAFETENSORS_FILE} or {PYTORCH_WEIGHTS_FILE} in {model_id}")
+
+    from huggingface_hub import hf_hub_download
+    from huggingface_hub.utils import EntryNotFoundError
+
+    try:
+        return hf_hub_download(model_id, SAFETENSORS_FILE, token=token)
+    except EntryNotFoundError:
+        return hf_hub_download(model_id, PYTORCH_WEIGHTS_FILE, token=token)
+
+
+def map_safetensors(path):
+    """{name: tensor} whose storage is a private mapping of the safetensors file"""
+    import torch
+
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    (header_size,) = struct.unpack("<Q", mapped[:8])
+    header = json.loads(mapped[8:8 + header_size])
+    data_start = 8 + header_size
+
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = getattr(torch, _SAFETENSORS_DTYPES[info["dtype"]])
+        begin, end = info["data_offsets"]
+        if begin == end:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        # frombuffer keeps a reference to the mapping, which stays open while any tensor lives
+        tensors[name] = torch.frombuffer(
+            mapped,
+            dtype=dtype,
+            count=(end - begin) // dtype.itemsize,
+            offset=data_start + begin,
+        ).view(info["shape"])
+    return tensors
+
+
+def map_weights(path):
+    """Memory-mapped state dict from a safetensors file or a zip-format torch checkpoint"""
+    if path.endswith(".safetensors"):
+        return map_safetensors(path)
+    import torch
+    return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+
+
+def load_mmap_model(model_id, token=None, torch_dtype=None, trust_remote_code=False):
+    """Image-classification model whose weights are views into the mapped checkpoint"""
+    from transformers import AutoConfig, AutoModelForImageClassification
+    try:
+        from transformers.modeling_utils import no_init_weights
+    except ImportError:  # transformers >= 5
+        from transformers.initialization import no_init_weights
+
+    config = AutoConfig.from_pretrained(model_id, token=token, trust_remote_code=trust_remote_code)
+    # Skip random initialisation: every parameter is about to be replaced
+    with no_init_weights():
+        model = AutoModelForImageClassification.from_config(
+            config, trust_remote_code=trust_remote_code)
+
+    path = resolve_weights_file(model_id, token=token)
+    state_dict = map_weights(path)
+    # Checkpoints of the bare base model lack its prefix; match what the model expects
+    expected = model.state_dict().keys()
+    prefix = model.base_model_prefix
+    if prefix and not any(key.startswith(prefix + ".") for key in state_dict):
+        if any(key.startswith(prefix + ".") for key in expected):
+            state_dict = {
+                key if key in expected else f"{prefix}.{key}": tensor
+                for key, tensor in state_dict.items()
+            }
+    # assign=True swaps the mapped tensors in instead of copying into the fresh ones
+    missing, unexpected = model.load_state_dict(state_dict, strict=False, assign=True)
+    if missing:
+        raise ValueError(f"Weights missing from {path}: {missing}")
+    if unexpected:
+        logger.warning(f"Ignoring unexpected weights: {unexpected}")
+    model.tie_weights()
+
+    if torch_dtype is not None and next(model.parameters()).dtype != torch_dtype:
+        # Converting copies every weight into private memory, losing the sharing
+        logger.warning(f"Converting mapped weights to {torch_dtype}; they will no longer be shared")
+        model = model.to(torch_dtype)
+    model.eval()
+    logger.info(f"Mapped weights from {path}")
+    return model
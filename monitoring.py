@@ -0,0 +1,73 @@
+"""Helpers for continuous camera monitoring over a WebSocket"""
+import asyncio
+import io
+from collections import deque
+
+from PIL import Image
+
+from phash_index import dhash
+
+
+class LatestFrame:
+    """Single-slot mailbox where a newer frame replaces one not yet taken.
+
+    The reader always gets the most recent frame; frames overwritten while
+    inference was busy are counted as dropped.
+    """
+
+    def __init__(self):
+        self._frame = None
+        self._event = asyncio.Event()
+        self.received = 0
+        self.dropped = 0
+
+    def put(self, frame):
+        """Store frame; returns True if it replaced one that was never processed"""
+        self.received += 1
+        dropped = self._frame is not None
+        if dropped:
+            self.dropped += 1
+        self._frame = frame
+        self._event.set()
+        return dropped
+
+    async def take(self):
+        await self._event.wait()
+        self._event.clear()
+        frame, self._frame = self._frame, None
+        return frame
+
+
+def frame_dhash(contents):
+    """Perceptual hash of an encoded frame, decoding as little as possible"""
+    with Image.open(io.BytesIO(contents)) as image:
+        return dhash(image)
+
+
+class ScoreSmoother:
+    """Per-label scores averaged over the last window frames.
+
+    A label missing from a frame's predictions counts as 0 for that frame,
+    so a label has to keep showing up to keep a high smoothed score.
+    """
+
+    def __init__(self, window=10):
+        self._frames = deque(maxlen=window)
+
+    def add(self, preds):
+        self._frames.append({pred["label"]: float(pred["score"]) for pred in preds})
+
+    def scores(self):
+        """{label: mean score} over the window, highest first"""
+        if not self._frames:
+            return {}
+        totals = {}
+        for frame in self._frames:
+            for label, score in frame.items():
+                totals[label] = totals.get(label, 0.0) + score
+        count = len(self._frames)
+        return dict(sorted(((label, round(total / count, 4)) for label, total in totals.items()),
+                           key=lambda item: item[1], reverse=True))
+
+    def __len__(self):
+        return len(self._frames)
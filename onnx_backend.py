@@ -0,0 +1,70 @@
+"""ONNX Runtime inference backend for the fish disease classifier.
+
+OnnxImageClassifier is a drop-in replacement for the transformers
+image-classification pipeline: it takes PIL images and returns the same
+[{"label": ..., "score": ...}] lists, so the /predict response contract
+does not change. Models are produced by export_onnx.py.
+"""
+import json
+import os
+
+import numpy as np
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_QUANTIZED_MODEL_FILE = "model.int8.onnx"
+
+
+def _softmax(logits):
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class OnnxImageClassifier:
+    """Image classifier running an exported model on ONNX Runtime (CPU)"""
+
+    def __init__(self, model_dir, quantized=False, intra_op_threads=0, top_k=5):
+        import onnxruntime as ort
+        from transformers import AutoImageProcessor
+
+        self.model_dir = model_dir
+        self.quantized = quantized
+        self.top_k = top_k
+        model_file = ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        self.model_path = os.path.join(model_dir, model_file)
+
+        with open(os.path.join(model_dir, "config.json")) as f:
+            config = json.load(f)
+        self.id2label = {int(k): v for k, v in config["id2label"].items()}
+        self.processor = AutoImageProcessor.from_pretrained(model_dir)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads > 0:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(
+            self.model_path,
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict_proba(self, images):
+        """Class probabilities for a list of RGB PIL images, shape (batch, classes)"""
+        inputs = self.processor(images=images, return_tensors="np")
+        pixel_values = inputs["pixel_values"].astype(np.float32)
+        (logits,) = self.session.run(None, {self.input_name: pixel_values})
+        return _softmax(logits)
+
+    def __call__(self, images, batch_size=None, top_k=None):
+        top_k = top_k or self.top_k
+        single = not isinstance(images, list)
+        batch = [images] if single else images
+        results = []
+        for probs in self.predict_proba(batch):
+            order = np.argsort(probs)[::-1][:top_k]
+            results.append([
+                {"label": self.id2label[int(i)], "score": float(probs[i])}
+                for i in order
+            ])
+        return results[0] if single else results
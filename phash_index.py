@@ -0,0 +1,141 @@
+"""Perceptual hashing and a near-duplicate index for reusing predictions.
+
+Frames from a fixed camera differ by a few bytes (EXIF, recompression,
+sensor noise) so their SHA-256 never repeats, but their difference hash
+(dHash) stays within a few bits. PerceptualIndex maps dHashes to the
+exact digest of an image that was already classified, and finds the
+closest one within a Hamming threshold using a BK-tree.
+"""
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+HASH_SIZE = 8
+
+
+def dhash(image, hash_size=HASH_SIZE):
+    """64-bit difference hash: brightness gradients of a (hash_size+1) x hash_size thumbnail"""
+    if image.format == 'JPEG':
+        # Let libjpeg decode at 1/8 scale; only a tiny thumbnail is needed
+        image.draft('L', (hash_size * 8, hash_size * 8))
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BOX)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return value
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """Burkhard-Keller tree over integer hashes with Hamming distance.
+
+    Nodes are [hash, value, {distance: child}]. Search only descends into
+    children whose edge distance is within max_distance of the query's
+    distance to the parent (triangle inequality), so most of the tree is
+    skipped for small thresholds.
+    """
+
+    def __init__(self):
+        self._root = None
+        self.size = 0
+
+    def add(self, hash_value, value):
+        self.size += 1
+        if self._root is None:
+            self._root = [hash_value, value, {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming(hash_value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_value, value, {}]
+                return
+            node = child
+
+    def search(self, hash_value, max_distance):
+        """All (distance, hash, value) within max_distance, closest first"""
+        if self._root is None:
+            return []
+        matches = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(hash_value, node[0])
+            if distance <= max_distance:
+                matches.append((distance, node[0], node[1]))
+            low, high = distance - max_distance, distance + max_distance
+            stack.extend(child for edge, child in node[2].items() if low <= edge <= high)
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+
+class PerceptualIndex:
+    """Bounded dHash -> digest index with nearest-match lookup.
+
+    Entries beyond max_entries are evicted oldest first. BK-trees cannot
+    delete, so evicted hashes stay in the tree as tombstones (skipped on
+    lookup) until they make up rebuild_ratio of it, when the tree is
+    rebuilt from the live entries.
+    """
+
+    def __init__(self, threshold=3, max_entries=50000, rebuild_ratio=0.5):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.rebuild_ratio = rebuild_ratio
+        self._entries = OrderedDict()
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+
+    def add(self, hash_value, digest):
+        with self._lock:
+            if self._entries.get(hash_value) == digest:
+                self._entries.move_to_end(hash_value)
+                return
+            self._entries[hash_value] = digest
+            self._entries.move_to_end(hash_value)
+            self._tree.add(hash_value, digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self._tree.size - len(self._entries) > self.rebuild_ratio * self._tree.size:
+                self._rebuild()
+
+    def _rebuild(self):
+        tree = BKTree()
+        for hash_value, digest in self._entries.items():
+            tree.add(hash_value, digest)
+        self._tree = tree
+        self.rebuilds += 1
+
+    def find(self, hash_value):
+        """(digest, distance) of the closest live entry within threshold, or None"""
+        with self._lock:
+            for distance, found, digest in self._tree.search(hash_value, self.threshold):
+                if self._entries.get(found) == digest:
+                    self.hits += 1
+                    return digest, distance
+            self.misses += 1
+            return None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "tree_nodes": self._tree.size,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "rebuilds": self.rebuilds,
+        }
@@ -0,0 +1,89 @@
+"""In-memory prediction cache keyed by image content and model id"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def image_digest(contents):
+    """SHA-256 hex digest of the uploaded image bytes"""
+    return hashlib.sha256(contents).hexdigest()
+
+
+def cache_key(digest, model_id):
+    """Cache key for an image digest under a given model"""
+    return f"{model_id}:{digest}"
+
+
+class PredictionCache:
+    """Bounded LRU cache with a per-entry TTL.
+
+    Values are the raw prediction lists returned by the model, so the same
+    entry can serve any response shape built on top of them.
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Insert or refresh key, evicting least recently used entries"""
+        if not self.enabled:
+            return
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
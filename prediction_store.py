@@ -0,0 +1,188 @@
+"""Persistent prediction store shared by all workers on a node.
+
+Backed by a single SQLite database in WAL mode so several uvicorn workers
+can read concurrently while one writes, and results survive redeploys as
+long as the file lives on a persistent disk.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    image_hash TEXT NOT NULL,
+    model_id TEXT NOT NULL,
+    result TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (image_hash, model_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS predictions_accessed_at ON predictions (accessed_at);
+"""
+
+
+class PredictionStore:
+    """Size-bounded SQLite key/value store for prediction lists.
+
+    Every thread gets its own connection. Entries are kept roughly in LRU
+    order via accessed_at, and the table is trimmed back to
+    ``compact_ratio * max_entries`` rows once it grows past ``max_entries``.
+    """
+
+    def __init__(self, path, max_entries=100000, compact_every=256,
+                 compact_ratio=0.9, touch_interval=300.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.compact_every = compact_every
+        self.compact_ratio = compact_ratio
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._writes_since_compact = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.compactions = 0
+        self.errors = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._init_database()
+
+    def _init_database(self):
+        """Create the schema with incremental auto-vacuum before switching to WAL.
+
+        auto_vacuum only takes effect if it is set before the first table
+        is created, and can't be changed once the database is in WAL mode,
+        so this uses a plain rollback-journal connection. A store created
+        without it is rebuilt once with VACUUM.
+        """
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+        try:
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.executescript(SCHEMA)
+            (auto_vacuum,) = conn.execute("PRAGMA auto_vacuum").fetchone()
+            if auto_vacuum != 2:
+                try:
+                    conn.execute("PRAGMA journal_mode=DELETE")
+                    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                    conn.execute("VACUUM")
+                    logger.info("Rebuilt prediction store with incremental auto-vacuum")
+                except sqlite3.Error as e:
+                    # Another worker has it open; a later start will retry
+                    logger.warning(f"Could not enable auto-vacuum on the prediction store: {str(e)}")
+        finally:
+            conn.close()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def get(self, image_hash, model_id):
+        """Return the stored prediction list, or None on a miss"""
+        try:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT result, accessed_at FROM predictions "
+                "WHERE image_hash = ? AND model_id = ?",
+                (image_hash, model_id),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            result, accessed_at = row
+            now = time.time()
+            # Only refresh recency occasionally so hits stay read-only
+            if now - accessed_at > self.touch_interval:
+                conn.execute(
+                    "UPDATE predictions SET accessed_at = ? "
+                    "WHERE image_hash = ? AND model_id = ?",
+                    (now, image_hash, model_id),
+                )
+            self.hits += 1
+            return json.loads(result)
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"Prediction store read failed: {str(e)}")
+            return None
+
+    def put(self, image_hash, model_id, preds):
+        """Insert or replace the prediction list for an image"""
+        now = time.time()
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO predictions "
+                "(image_hash, model_id, result, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (image_hash, model_id, json.dumps(preds), now, now),
+            )
+            self.writes += 1
+            self._writes_since_compact += 1
+            if self._writes_since_compact >= self.compact_every:
+                self._writes_since_compact = 0
+                self.compact()
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"Prediction store write failed: {str(e)}")
+
+    def compact(self):
+        """Drop least recently used rows once the store exceeds max_entries"""
+        conn = self._connection()
+        (count,) = conn.execute("SELECT COUNT(*) FROM predictions").fetchone()
+        if count <= self.max_entries:
+            return 0
+        excess = count - int(self.max_entries * self.compact_ratio)
+        conn.execute(
+            "DELETE FROM predictions WHERE (image_hash, model_id) IN ("
+            "SELECT image_hash, model_id FROM predictions "
+            "ORDER BY accessed_at LIMIT ?)",
+            (excess,),
+        )
+        # Frees one page per step; execute() would step it only once
+        conn.executescript("PRAGMA incremental_vacuum")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.compactions += 1
+        logger.info(f"Compacted prediction store: removed {excess} of {count} entries")
+        return excess
+
+    def count(self):
+        (count,) = self._connection().execute(
+            "SELECT COUNT(*) FROM predictions").fetchone()
+        return count
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "writes": self.writes,
+            "compactions": self.compactions,
+            "errors": self.errors,
+        }
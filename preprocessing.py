@@ -0,0 +1,120 @@
+"""Prepare uploaded images for the classifier.
+
+The model only ever sees a small input (224px for this classifier), so
+there is no point decoding, re-encoding and uploading full-resolution
+phone photos. Suitable JPEGs are passed through untouched; everything
+else is decoded at reduced size where the codec allows it, downscaled
+to the model resolution and encoded once.
+"""
+import io
+import threading
+
+from PIL import Image, ImageOps
+
+from phash_index import dhash
+
+
+class PreparedImage:
+    """Result of preprocessing one upload"""
+
+    def __init__(self, payload, strategy, original_size, size, bytes_in, dhash=None):
+        self.payload = payload
+        self.strategy = strategy
+        self.original_size = original_size
+        self.size = size
+        self.bytes_in = bytes_in
+        self.dhash = dhash
+
+    @property
+    def bytes_out(self):
+        return len(self.payload)
+
+    @property
+    def bytes_saved(self):
+        return self.bytes_in - self.bytes_out
+
+
+class PreprocessStats:
+    """Thread-safe counters for preprocessing outcomes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"passthrough": 0, "resized": 0, "reencoded": 0}
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def record(self, prepared):
+        with self._lock:
+            self.counts[prepared.strategy] += 1
+            self.bytes_in += prepared.bytes_in
+            self.bytes_out += prepared.bytes_out
+
+    def stats(self):
+        return {
+            **self.counts,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+        }
+
+
+def _scaled_size(size, target_size):
+    """Scale size so the shorter side equals target_size, never upscaling"""
+    width, height = size
+    scale = target_size / min(width, height)
+    if scale >= 1:
+        return size
+    return (max(1, round(width * scale)), max(1, round(height * scale)))
+
+
+def decode_image(contents):
+    """Decode image bytes into an RGB PIL image"""
+    image = Image.open(io.BytesIO(contents))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+
+def prepare_image(contents, target_size=224, passthrough_max_side=448, quality=90,
+                  compute_dhash=False):
+    """Return a PreparedImage whose payload is a JPEG ready for the model.
+
+    JPEGs that are already RGB and whose shorter side is at most
+    passthrough_max_side are sent as-is. Larger JPEGs use draft mode so
+    libjpeg decodes at 1/2, 1/4 or 1/8 scale, then every image is resized
+    so its shorter side is target_size and encoded as JPEG. With
+    compute_dhash the perceptual hash is taken from the decoded image.
+    """
+    image = Image.open(io.BytesIO(contents))
+    original_size = image.size
+
+    if (
+        image.format == 'JPEG'
+        and image.mode == 'RGB'
+        and min(original_size) <= passthrough_max_side
+    ):
+        return PreparedImage(contents, "passthrough", original_size,
+                             original_size, len(contents),
+                             dhash(image) if compute_dhash else None)
+
+    target = _scaled_size(original_size, target_size)
+    if image.format == 'JPEG':
+        # Let the decoder skip most of the DCT work for large photos
+        image.draft('RGB', target)
+
+    # Match the orientation the model would apply to the original upload
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    strategy = "reencoded"
+    new_size = _scaled_size(image.size, target_size)
+    if new_size != image.size:
+        image = image.resize(new_size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+        strategy = "resized"
+
+    img_byte_arr = io.BytesIO()
+    image.save(img_byte_arr, format='JPEG', quality=quality)
+    return PreparedImage(img_byte_arr.getvalue(), strategy, original_size,
+                         image.size, len(contents),
+                         dhash(image) if compute_dhash else None)
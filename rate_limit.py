@@ -0,0 +1,224 @@
+"""Per-client token-bucket rate limiting.
+
+Each client (a known API key, or the IP address otherwise) has a bucket
+that holds up to burst tokens and refills at rate tokens per second;
+every request spends some tokens. Buckets live in a pluggable store:
+InMemoryBucketStore for a single process (and as a local stand-in in
+tests), RedisBucketStore when several workers or nodes must share one
+quota.
+"""
+import hashlib
+import json
+import logging
+import math
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryBucketStore:
+    """Buckets in a bounded in-process LRU map"""
+
+    def __init__(self, max_keys=100000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets = OrderedDict()
+
+    async def take(self, key, rate, burst, cost):
+        """Spend cost tokens; returns (allowed, tokens_left, retry_after_seconds)"""
+        now = self._clock()
+        tokens, updated = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        retry_after = 0.0 if allowed else (cost - tokens) / rate
+        return allowed, tokens, retry_after
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def stats(self):
+        return {"backend": "memory", "tracked_clients": len(self._buckets)}
+
+
+# Refill and spend atomically on the Redis server; uses the server clock so
+# every node agrees on elapsed time
+_TAKE_SCRIPT = """
+local key = KEYS[1]
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', key, 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', key, 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBucketStore:
+    """Buckets shared through Redis, updated by a single Lua script per request"""
+
+    def __init__(self, client, prefix="ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(_TAKE_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis.asyncio as redis
+
+        return cls(redis.from_url(url), **kwargs)
+
+    async def take(self, key, rate, burst, cost):
+        allowed, tokens = await self._script(keys=[self.prefix + key], args=[rate, burst, cost])
+        tokens = float(tokens)
+        allowed = bool(int(allowed))
+        retry_after = 0.0 if allowed else (cost - tokens) / rate
+        return allowed, tokens, retry_after
+
+    async def close(self):
+        await self.client.aclose()
+
+    def stats(self):
+        return {"backend": "redis", "prefix": self.prefix}
+
+
+def client_key(headers, client_host, trusted_proxy_hops=1, api_keys=frozenset()):
+    """Identify the caller by API key, else by IP address.
+
+    Only keys in api_keys are trusted: an arbitrary key would otherwise buy
+    a fresh bucket on every request. Behind trusted_proxy_hops proxies that
+    append to X-Forwarded-For, the entry that many places from the right
+    was written by our own proxy and can't be spoofed by the client.
+    """
+    api_key = headers.get("x-api-key")
+    if api_key and api_key in api_keys:
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:32]
+    forwarded = headers.get("x-forwarded-for")
+    if forwarded and trusted_proxy_hops > 0:
+        hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+        if hops:
+            return "ip:" + hops[-min(trusted_proxy_hops, len(hops))]
+    return "ip:" + (client_host or "unknown")
+
+
+def validate_limits(rate, burst, costs):
+    """Raise ValueError for limits no request could ever satisfy.
+
+    A zero or negative rate never refills (and would divide by zero when
+    computing Retry-After); a cost above burst can never be paid, so such
+    requests would be rejected forever with a misleading Retry-After.
+    """
+    if rate <= 0:
+        raise ValueError(f"Rate limit refill rate must be positive, got {rate}")
+    if burst <= 0:
+        raise ValueError(f"Rate limit burst must be positive, got {burst}")
+    for prefix, cost in costs.items():
+        per_method = cost if isinstance(cost, dict) else {"": cost}
+        for method, value in per_method.items():
+            if value < 0 or value > burst:
+                raise ValueError(
+                    f"Rate limit cost {value} for {f'{method} ' if method else ''}{prefix} "
+                    f"must be between 0 and the burst of {burst}"
+                )
+
+
+class RateLimitMiddleware:
+    """ASGI middleware applying token buckets before the request body is read.
+
+    costs maps path prefixes to token costs; other paths are not limited.
+    A prefix may instead map to {method: cost} to limit only some methods.
+    api_keys lists the X-API-Key values that get their own bucket.
+    Rejections get 429 with Retry-After; admitted responses carry
+    X-RateLimit-Limit and X-RateLimit-Remaining. If the store fails the
+    request is let through so a Redis outage can't take the API down.
+    """
+
+    def __init__(self, app, store, rate, burst, costs, trusted_proxy_hops=1,
+                 api_keys=(), on_reject=None, on_error=None):
+        validate_limits(rate, burst, costs)
+        self.app = app
+        self.store = store
+        self.rate = rate
+        self.burst = burst
+        # Longest prefix first so /predict/batch wins over /predict
+        self.costs = sorted(costs.items(), key=lambda item: len(item[0]), reverse=True)
+        self.trusted_proxy_hops = trusted_proxy_hops
+        self.api_keys = frozenset(api_keys)
+        self.on_reject = on_reject
+        self.on_error = on_error
+
+    def _cost(self, method, path):
+        for prefix, cost in self.costs:
+            if path == prefix or path.startswith(prefix + "/"):
+                if isinstance(cost, dict):
+                    return cost.get(method, 0)
+                return cost
+        return 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        cost = self._cost(scope["method"], scope["path"])
+        if not cost:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+        client = scope.get("client")
+        key = client_key(headers, client[0] if client else None, self.trusted_proxy_hops,
+                         self.api_keys)
+        try:
+            allowed, tokens, retry_after = await self.store.take(key, self.rate, self.burst, cost)
+        except Exception as e:
+            logger.warning(f"Rate limit store unavailable, allowing request: {str(e)}")
+            if self.on_error:
+                self.on_error()
+            await self.app(scope, receive, send)
+            return
+
+        limit_headers = [
+            (b"x-ratelimit-limit", f"{self.burst:g}".encode()),
+            (b"x-ratelimit-remaining", str(int(tokens)).encode()),
+        ]
+        if not allowed:
+            if self.on_reject:
+                self.on_reject()
+            body = json.dumps({"detail": "Rate limit exceeded, please slow down"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+                    (b"access-control-allow-origin", b"*"),
+                    *limit_headers,
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_with_limits(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), *limit_headers]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_limits)
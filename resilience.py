@@ -0,0 +1,171 @@
+"""Circuit breaker, retry budget and backoff for calls to the inference API"""
+import math
+import random
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised when the breaker is open and calls should fail fast"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Circuit open, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    After failure_threshold consecutive failures the breaker opens and
+    rejects calls for reset_timeout seconds. It then lets up to
+    half_open_max_calls probe calls through; one success closes it again,
+    one failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=15.0, half_open_max_calls=1,
+                 clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self.rejections = 0
+        self.trips = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._half_open_calls = 0
+        return self._state
+
+    def retry_after(self):
+        """Seconds until the breaker will let a probe through"""
+        with self._lock:
+            if self._current_state() != OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (self._clock() - self._opened_at))
+
+    def before_call(self):
+        """Reserve a call slot or raise CircuitOpenError"""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+                self._half_open_calls += 1
+                return
+            self.rejections += 1
+            if state == OPEN:
+                remaining = self.reset_timeout - (self._clock() - self._opened_at)
+            else:
+                # Probe already in flight; check back shortly
+                remaining = 1.0
+            raise CircuitOpenError(max(remaining, 0.0))
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._half_open_calls = 0
+
+    def record_failure(self):
+        with self._lock:
+            state = self._current_state()
+            self._failures += 1
+            if state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if state != OPEN:
+                    self.trips += 1
+                self._state = OPEN
+                self._opened_at = self._clock()
+                self._half_open_calls = 0
+
+    def release(self):
+        """Give back a half-open probe slot when the call was neither success nor failure"""
+        with self._lock:
+            if self._state == HALF_OPEN and self._half_open_calls > 0:
+                self._half_open_calls -= 1
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "trips": self.trips,
+            "rejections": self.rejections,
+            "retry_after": round(self.retry_after(), 2),
+        }
+
+
+class RetryBudget:
+    """Caps retries to a fraction of recent request volume.
+
+    Every request deposits ratio tokens and every retry withdraws one, so
+    during an outage retries add at most ratio extra load instead of
+    multiplying it. min_per_second tokens are always trickled in so low
+    traffic can still retry.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=1.0, max_tokens=50.0, clock=time.monotonic):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tokens = max_tokens
+        self._updated = clock()
+        self.spent = 0
+        self.denied = 0
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.max_tokens,
+                           self._tokens + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def record_request(self):
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self):
+        """Take one retry token if available"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                self.spent += 1
+                return True
+            self.denied += 1
+            return False
+
+    def stats(self):
+        with self._lock:
+            self._refill()
+            tokens = self._tokens
+        return {
+            "tokens": round(tokens, 2),
+            "retries_spent": self.spent,
+            "retries_denied": self.denied,
+        }
+
+
+def backoff_delay(attempt, base=0.2, cap=2.0, rng=random):
+    """Full-jitter exponential backoff for the given retry attempt (0-based)"""
+    return rng.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def retry_after_header(seconds):
+    """Retry-After value in whole seconds, at least 1"""
+    return str(max(1, math.ceil(seconds)))
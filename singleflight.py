@@ -0,0 +1,51 @@
+"""Coalesce concurrent calls for the same key into a single execution"""
+import asyncio
+
+
+class SingleFlight:
+    """Share one in-flight coroutine between all callers of the same key.
+
+    The first caller for a key starts the work as a task; callers that
+    arrive while it is running await the same task and receive its result
+    or exception. The task is shielded, so a disconnecting client does not
+    cancel work other callers are waiting on.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn, *args):
+        """Await fn(*args) once per key.
+
+        Returns (result, shared) where shared is True when this caller
+        joined a call started by someone else.
+        """
+        task = self._calls.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(fn(*args))
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+            self.started += 1
+        return await asyncio.shield(task), shared
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception as retrieved even if every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self):
+        return len(self._calls)
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
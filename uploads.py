@@ -0,0 +1,276 @@
+"""Helpers for turning uploaded files into image payloads"""
+import io
+import os
+import zipfile
+import zlib
+
+from PIL import Image, UnidentifiedImageError
+from starlette.exceptions import HTTPException
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tif", ".tiff")
+ZIP_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed")
+
+# Enough leading bytes to recognise every format below
+SNIFF_BYTES = 12
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class UploadRejected(ValueError):
+    """Raised when an upload fails validation; carries the HTTP status to return"""
+
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def sniff_image_format(head):
+    """Image format from the file signature, or None if it isn't a supported image"""
+    if head[:3] == b"\xff\xd8\xff":
+        return "JPEG"
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        return "PNG"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "GIF"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    if head[:2] == b"BM":
+        return "BMP"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "TIFF"
+    return None
+
+
+async def iter_upload(file, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Yield an UploadFile's contents in chunks"""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def read_limited(chunks, max_bytes, sniff=True):
+    """Collect an async stream of byte chunks, enforcing limits as it goes.
+
+    Reading stops with 413 as soon as more than max_bytes have arrived, and
+    with 415 as soon as the first bytes show the data is not an image, so a
+    bad upload is never buffered in full.
+    """
+    buffer = bytearray()
+    sniffed = not sniff
+    async for chunk in chunks:
+        buffer += chunk
+        if len(buffer) > max_bytes:
+            raise UploadRejected(413, f"Upload exceeds the {max_bytes} byte limit")
+        if not sniffed and len(buffer) >= SNIFF_BYTES:
+            if sniff_image_format(buffer) is None:
+                raise UploadRejected(415, "Unsupported or unrecognised image format")
+            sniffed = True
+    if not buffer:
+        raise UploadRejected(400, "Upload is empty")
+    if not sniffed and sniff_image_format(buffer) is None:
+        raise UploadRejected(415, "Unsupported or unrecognised image format")
+    return bytes(buffer)
+
+
+def check_image_header(contents, max_pixels):
+    """Validate an image from its header alone and return (format, (width, height)).
+
+    PIL only parses the header on open, so dimensions are checked before
+    any pixel data is decoded; images over max_pixels are rejected as
+    likely decompression bombs.
+    """
+    if sniff_image_format(contents[:SNIFF_BYTES]) is None:
+        raise UploadRejected(415, "Unsupported or unrecognised image format")
+    try:
+        with Image.open(io.BytesIO(contents)) as image:
+            width, height = image.size
+            image_format = image.format
+    except Image.DecompressionBombError:
+        raise UploadRejected(413, "Image dimensions are too large")
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        raise UploadRejected(400, "Invalid or corrupt image file")
+    if width * height > max_pixels:
+        raise UploadRejected(413, f"Image is {width}x{height}, limit is {max_pixels} pixels")
+    return image_format, (width, height)
+
+
+class BodySizeLimitMiddleware:
+    """ASGI middleware capping request body size per path prefix.
+
+    A declared Content-Length over the limit is refused with 413 before
+    anything is read; chunked bodies are counted as they stream in and cut
+    off with 413 once they pass the limit.
+    """
+
+    def __init__(self, app, limits):
+        self.app = app
+        # Longest prefix first so /predict/batch wins over /predict
+        self.limits = sorted(limits.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def _limit(self, path):
+        for prefix, limit in self.limits:
+            if path == prefix or path.startswith(prefix + "/"):
+                return limit
+        return None
+
+    async def __call__(self, scope, receive, send):
+        limit = self._limit(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                await self._reject(send, limit)
+                return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Surfaces through the app's exception handling as a 413
+                    raise HTTPException(413, f"Request body exceeds the {limit} byte limit")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    async def _reject(self, send, limit):
+        body = f'{{"detail":"Request body exceeds the {limit} byte limit"}}'.encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"access-control-allow-origin", b"*"),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def is_zip_upload(filename, content_type, contents):
+    """True if an upload looks like a zip archive"""
+    if content_type in ZIP_CONTENT_TYPES or (filename or "").lower().endswith(".zip"):
+        return True
+    return contents[:4] == b"PK\x03\x04"
+
+
+def peek(file, size=SNIFF_BYTES):
+    """First size bytes of a binary file, leaving its position at the start"""
+    file.seek(0)
+    head = file.read(size)
+    file.seek(0)
+    return head
+
+
+class BatchImage:
+    """One image of a batch, read from its upload or archive only when needed.
+
+    read() and save() stop with 413 as soon as more than max_bytes have
+    come out, whatever size was declared, so only images being processed
+    are ever held in memory.
+    """
+
+    def __init__(self, filename, max_bytes):
+        self.filename = filename
+        self.max_bytes = max_bytes
+
+    def _chunks(self):
+        raise NotImplementedError
+
+    def _limited_chunks(self):
+        size = 0
+        for chunk in self._chunks():
+            size += len(chunk)
+            if size > self.max_bytes:
+                raise UploadRejected(413, f"{self.filename} exceeds the {self.max_bytes} byte limit")
+            yield chunk
+
+    def read(self):
+        """The image bytes"""
+        contents = b"".join(self._limited_chunks())
+        if not contents:
+            raise UploadRejected(400, "Upload is empty")
+        return contents
+
+    def save(self, path):
+        """Stream the image to path and return the number of bytes written"""
+        size = 0
+        with open(path, "wb") as f:
+            for chunk in self._limited_chunks():
+                f.write(chunk)
+                size += len(chunk)
+        return size
+
+
+class UploadedImage(BatchImage):
+    """An image in an upload's spooled temporary file"""
+
+    def __init__(self, file, filename, max_bytes):
+        super().__init__(filename, max_bytes)
+        self.file = file
+
+    def _chunks(self):
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+class ZipMemberImage(BatchImage):
+    """An image inside a zip archive, inflated as it is read"""
+
+    def __init__(self, archive, info, max_bytes):
+        super().__init__(info.filename, max_bytes)
+        self.archive = archive
+        self.info = info
+
+    def _chunks(self):
+        try:
+            with self.archive.open(self.info) as member:
+                while True:
+                    chunk = member.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        return
+                    yield chunk
+        except (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError, RuntimeError):
+            raise UploadRejected(400, f"Could not extract {self.filename} from the archive")
+
+
+def list_zip_images(file, max_images, max_entry_bytes, max_total_bytes):
+    """Return a ZipMemberImage for each image file inside a zip archive.
+
+    Only the archive's directory is read. Entries are filtered by extension
+    and checked against the declared uncompressed sizes, so a zip bomb is
+    rejected without decompressing it; each image is inflated later, when
+    it is read.
+    """
+    try:
+        archive = zipfile.ZipFile(file)
+    except zipfile.BadZipFile:
+        raise ValueError("Uploaded archive is not a valid zip file")
+
+    entries = [
+        info for info in archive.infolist()
+        if not info.is_dir()
+        and not os.path.basename(info.filename).startswith(".")
+        and "__MACOSX" not in info.filename
+        and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+    if len(entries) > max_images:
+        raise ValueError(f"Archive contains {len(entries)} images, limit is {max_images}")
+    if sum(info.file_size for info in entries) > max_total_bytes:
+        raise ValueError("Archive is too large once uncompressed")
+    for info in entries:
+        if info.file_size > max_entry_bytes:
+            raise ValueError(f"{info.filename} exceeds the per-image size limit")
+    return [ZipMemberImage(archive, info, max_entry_bytes) for info in entries]